@@ -0,0 +1,64 @@
+import argparse
+import contextlib
+import glob
+import io
+import os
+import sys
+import time
+from utils.groff_util import GroffUtil
+
+script_dir = sys.path[0]
+project_dir = os.path.abspath(os.path.join(script_dir, ".."))
+manpage_dir = "%s/tests/manpages" % project_dir
+
+# Parse every manpage with an engine, the messages printed by parseGroff are kept as a part of the result
+def parseManpages(engine, input_path_list):
+    groff_util = GroffUtil(engine)
+    result_dict = {}
+    start_time = time.time()
+    for input_path in input_path_list:
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            try:
+                result = groff_util.parseGroff(input_path)
+            except Exception as e:
+                result = "%s: %s" % (type(e).__name__, e)
+        if isinstance(result, tuple):
+            result = (result[0], list(result[1].items()))
+        result_dict[input_path] = (result, output.getvalue())
+    return result_dict, time.time() - start_time
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='''
+    CarpetFuzz - an NLP-based fuzzing assitance tool for generating valid option combinations.
+        benchmark_groff.py - compare the speed and the output of the groff parser engines.
+    ''', formatter_class=argparse.RawTextHelpFormatter)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--dir', type=str, help = 'Directory of input manpage files (default=tests/manpages)', default=manpage_dir)
+    group.add_argument('--glob', type=str, help = 'Glob pattern of input manpage files, e.g., "/usr/share/man/man1/*.1"')
+
+    args = parser.parse_args()
+
+    if args.glob:
+        input_path_list = sorted(glob.glob(args.glob))
+    else:
+        input_path_list = sorted([os.path.join(args.dir, filename) for filename in os.listdir(args.dir)])
+    input_path_list = [input_path for input_path in input_path_list if os.path.isfile(input_path)]
+    if len(input_path_list) == 0:
+        print("[x] Error: No manpage file is found")
+        exit(1)
+
+    print("[*] Parsing %d manpages ..." % len(input_path_list))
+    legacy_dict, legacy_time = parseManpages("legacy", input_path_list)
+    tokenizer_dict, tokenizer_time = parseManpages("tokenizer", input_path_list)
+
+    mismatch_list = [input_path for input_path in input_path_list if legacy_dict[input_path] != tokenizer_dict[input_path]]
+    for input_path in mismatch_list:
+        print("[WARN] The engines disagree on %s" % input_path)
+
+    print("[*] legacy: %.2fs, tokenizer: %.2fs, speedup: %.2fx" % (legacy_time, tokenizer_time, legacy_time / max(tokenizer_time, 1e-9)))
+    if len(mismatch_list) > 0:
+        print("[x] Error: %d of %d manpages have different outputs" % (len(mismatch_list), len(input_path_list)))
+        exit(1)
+    print("[OK] The outputs of %d manpages are identical" % len(input_path_list))
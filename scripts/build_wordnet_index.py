@@ -0,0 +1,25 @@
+import argparse
+import os
+import sys
+from utils.wordnet_util import WordNetUtil
+
+script_dir = sys.path[0]
+project_dir = os.path.abspath(os.path.join(script_dir, ".."))
+index_path = "%s/models/wordnet_index.json.gz" % project_dir
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='''
+    CarpetFuzz - an NLP-based fuzzing assitance tool for generating valid option combinations.
+        build_wordnet_index.py - precompute the synonyms and antonyms of WordNet lemmas for find_relationship.py.
+    ''', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--output', type=str, help = 'Path to the output index file (default=models/wordnet_index.json.gz)', default=index_path)
+
+    args = parser.parse_args()
+
+    output_path = args.output
+
+    print("[*] Building WordNet index ...")
+    word_num = WordNetUtil().buildIndex(output_path)
+
+    print("[OK] Successfully generate the WordNet index of %d words - %s" % (word_num, output_path))
@@ -2,19 +2,47 @@ import argparse
 import json
 import os
 import sys
-from utils.groff_util import GroffUtil
-from utils.nlp_util import NLPUtil
+import glob
+import psutil
+import tempfile
+import multiprocessing
+from hashlib import md5
+from nltk.tree import Tree
+from utils.cache_util import CacheUtil
+from utils.groff_util import GroffUtil, read_errors
+from utils.nlp_util import NLPUtil, getModelStamp
 from utils.model_util import ModelUtil
 from utils.relationship_util import RelationshipUtil
 
 script_dir = sys.path[0]
 project_dir = os.path.abspath(os.path.join(script_dir, ".."))
 model_dir = "%s/models" % project_dir
+constituency_model_path = "%s/elmo-constituency-parser-2020.02.10.tar.gz" % model_dir
 output_dir = "%s/output/relation" % project_dir
+parse_cache_dir = "%s/output/cache/parse" % project_dir
+relation_cache_dir = "%s/output/cache/relation" % project_dir
+record_dir = "%s/output/cache/record" % project_dir
+wordnet_index_path = "%s/wordnet_index.json.gz" % model_dir
+sent2vec_model_path = "%s/linux_w2v_300d.model" % model_dir
+xgb_model_path = "%s/xgb.m" % model_dir
+# Source files whose changes may change the relation files
+code_path_list = ["%s/%s" % (script_dir, filename) for filename in ["find_relationship.py", "utils/groff_util.py", "utils/nlp_util.py", "utils/model_util.py", "utils/relationship_util.py", "utils/wordnet_util.py", "utils/constant.py"]]
 
 groff_util = GroffUtil()
-nlp_util = NLPUtil("%s/elmo-constituency-parser-2020.02.10.tar.gz" % model_dir)
-relationship_util = RelationshipUtil(nlp_util)
+# Created by getNLPUtil, with the settings below
+nlp_util = None
+relationship_util = None
+parse_batch_size = 32
+pipe_batch_size = 256
+pipe_process_num = 1
+# Constituency trees and spaCy docs are cached on disk (1GB by default), since option descriptions recur across manpages and runs
+parse_cache_size = 1024 * 1024 * 1024
+model_util = None
+# Relation data of the analyzed manpages (256MB by default), keyed by the content of the manpage and the stamp of the models and the code
+relation_cache_util = CacheUtil(relation_cache_dir, 256 * 1024 * 1024)
+relation_stamp = None
+# Ignore the cached relation data and the option records, the fresh results are still cached
+force_analysis = False
 
 # ############################## #
 # #### Explicit R-sentences #### #
@@ -25,27 +53,127 @@ def identifyExplicitRSentences(program, opt_desc_dict, alias_dict, all_option_li
     formatted_list = nlp_util.formatOptDescDict(program, opt_desc_dict)
     preprocessed_list = nlp_util.preprocessing(formatted_list, alias_dict, all_option_list)
 
-    sent2vec_model_path = "%s/linux_w2v_300d.model" % model_dir
-    xgb_model_path = "%s/xgb.m" % model_dir
-    feature_num = 300
-    threshold = 0.5
-    model_util = ModelUtil(xgb_model_path, sent2vec_model_path, feature_num, threshold)
     # Explicit R-sentences
-    positive_list, negative_list = model_util.prediction(preprocessed_list)
+    positive_list, negative_list = getModelUtil().prediction(preprocessed_list)
     return positive_list, negative_list
 
+def getModelUtil():
+    global model_util
+    # Load the Word2Vec and XGBoost models on the first call only, so that a long-running process keeps them resident
+    if model_util is None:
+        feature_num = 300
+        threshold = 0.5
+        model_util = ModelUtil(xgb_model_path, sent2vec_model_path, feature_num, threshold)
+    return model_util
+
+def getNLPUtil():
+    global nlp_util, relationship_util
+    # Load spaCy and the constituency parser on the first call only, so that they are not loaded at all if every manpage is cached
+    if nlp_util is None:
+        nlp_util = NLPUtil(constituency_model_path, parse_batch_size, parse_cache_dir, parse_cache_size)
+        nlp_util.pipe_batch_size = pipe_batch_size
+        nlp_util.pipe_process_num = pipe_process_num
+        # The precomputed WordNet index is optional, see build_wordnet_index.py
+        if os.path.exists(wordnet_index_path):
+            nlp_util.loadWordNetIndex(wordnet_index_path)
+        relationship_util = RelationshipUtil(nlp_util)
+    return nlp_util
+
 # ############################## #
 # #### Implicit R-sentences #### #
 # ############################## #
 
-def identifyImplicitRSentences(program, opt_desc_dict):
-    # Extract topic sentences (first sentence)
-    topic_sent_list = nlp_util.extractTopicSentList(program, opt_desc_dict)
-
-    implicit_rsent_list = relationship_util.findImplicitPair(topic_sent_list)
+# The topic sentences (first sentences) are extracted by identifyRSentencesIncrementally. The pairs of two reused sentences
+# (indexes in reused_idx_set) are not compared again, they are implicit R-sentences iff their indexes are in reused_pair_set.
+def identifyImplicitRSentences(topic_sent_list, reused_idx_set=frozenset(), reused_pair_set=frozenset()):
+    implicit_rsent_list = relationship_util.findImplicitPair(topic_sent_list, reused_idx_set, reused_pair_set)
 
     return implicit_rsent_list
 
+# ################################ #
+# #### Incremental R-sentences #### #
+# ################################ #
+
+# The record of a program keeps the description and the R-sentences of each option from the previous run,
+# i.e., {"stamp": ..., "option_signature": ..., "options": {opt: {"desc": ..., "explicit": [...], "topic": [...]}}, "implicit": [[[opt, idx], [opt, idx]], ...]}
+def loadOptionRecord(program):
+    record_path = "%s/record_%s.json" % (record_dir, program)
+    if force_analysis or not os.path.exists(record_path):
+        return {}
+    try:
+        with open(record_path, "r") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # The R-sentences are only valid for the same models and code
+    if record.get("stamp") != getRelationStamp():
+        return {}
+    return record
+
+def saveOptionRecord(program, record):
+    if not os.path.exists(record_dir):
+        os.makedirs(record_dir, exist_ok=True)
+    # Write into a temporary file first, since the workers of a batch may analyze two manpages of the same program
+    fd, tmpfile_path = tempfile.mkstemp(dir=record_dir, prefix=".tmp-")
+    with os.fdopen(fd, "w") as f:
+        f.write(json.dumps(record))
+    os.replace(tmpfile_path, "%s/record_%s.json" % (record_dir, program))
+
+# The explicit R-sentences of an option also depend on the other options (replaced as param_other) and its aliases
+def getOptionSignature(option_list, alias_dict):
+    return md5(json.dumps([option_list, alias_dict], sort_keys=True).encode("utf-8")).hexdigest()
+
+# Identify the R-sentences of the options whose descriptions changed since the previous run only, and reuse the others from the record.
+# Return the R-sentences in the same order as a full run, and the new record.
+def identifyRSentencesIncrementally(program, opt_desc_dict, alias_dict, option_list):
+    record = loadOptionRecord(program)
+    option_record_dict = record.get("options", {})
+    reused_option_set = set([opt for opt in opt_desc_dict if opt in option_record_dict and option_record_dict[opt]["desc"] == opt_desc_dict[opt]])
+    option_signature = getOptionSignature(option_list, alias_dict)
+    explicit_reused_option_set = reused_option_set if record.get("option_signature") == option_signature else set()
+    print("[*] Reuse the R-sentences of %d of %d options" % (len(reused_option_set), len(opt_desc_dict)))
+
+    # Explicit R-sentences, the sentences of each option are classified independently
+    explicit_rsent_dict = {opt: [] for opt in opt_desc_dict}
+    changed_desc_dict = {opt: opt_desc_dict[opt] for opt in opt_desc_dict if opt not in explicit_reused_option_set}
+    if changed_desc_dict:
+        explicit_rsent_list, _ = identifyExplicitRSentences(program, changed_desc_dict, alias_dict, option_list)
+        for sent_dict in explicit_rsent_list:
+            explicit_rsent_dict[sent_dict["option"]].append(sent_dict)
+    for opt in explicit_reused_option_set:
+        explicit_rsent_dict[opt] = option_record_dict[opt]["explicit"]
+    explicit_rsent_list = [sent_dict for opt in opt_desc_dict for sent_dict in explicit_rsent_dict[opt]]
+
+    # Implicit R-sentences, only the pairs involving a changed topic sentence are compared again
+    topic_sent_dict = nlp_util.extractTopicSentDict(program, {opt: opt_desc_dict[opt] for opt in opt_desc_dict if opt not in reused_option_set})
+    for opt in reused_option_set:
+        topic_sent_dict[opt] = [dict(topic_sent, tree=Tree.fromstring(topic_sent["tree"])) for topic_sent in option_record_dict[opt]["topic"]]
+    topic_key_list = [(opt, idx) for opt in opt_desc_dict for idx in range(len(topic_sent_dict.get(opt, [])))]
+    topic_sent_list = [topic_sent_dict[opt][idx] for opt, idx in topic_key_list]
+    topic_idx_dict = {topic_key: idx for idx, topic_key in enumerate(topic_key_list)}
+    reused_idx_set = set([idx for idx, topic_key in enumerate(topic_key_list) if topic_key[0] in reused_option_set])
+    reused_pair_set = set()
+    for key_1, key_2 in record.get("implicit", []):
+        key_1, key_2 = tuple(key_1), tuple(key_2)
+        if key_1 in topic_idx_dict and key_2 in topic_idx_dict:
+            # The options may be listed in another order now, and findImplicitPair compares (i, j) with i < j
+            idx_1, idx_2 = topic_idx_dict[key_1], topic_idx_dict[key_2]
+            reused_pair_set.add((min(idx_1, idx_2), max(idx_1, idx_2)))
+    implicit_rsent_list = identifyImplicitRSentences(topic_sent_list, reused_idx_set, reused_pair_set)
+
+    # Record the R-sentences for the next run
+    topic_key_dict = {id(topic_sent): topic_key for topic_sent, topic_key in zip(topic_sent_list, topic_key_list)}
+    new_record = {"stamp": getRelationStamp(), "option_signature": option_signature, "options": {}, "implicit": []}
+    for opt in opt_desc_dict:
+        new_record["options"][opt] = {
+            "desc": opt_desc_dict[opt],
+            "explicit": explicit_rsent_dict[opt],
+            "topic": [dict(topic_sent, tree=topic_sent["tree"].pformat(margin=sys.maxsize)) for topic_sent in topic_sent_dict.get(opt, [])]
+        }
+    new_record["implicit"] = [[topic_key_dict[id(pair[0])], topic_key_dict[id(pair[1])]] for pair in implicit_rsent_list]
+
+    return explicit_rsent_list, implicit_rsent_list, new_record
+
 # ################################# #
 # #### Relationship Extraction #### #
 # ################################# #
@@ -76,23 +204,25 @@ def constructOutputDict(option_list, relationship_dict):
 
     return output_dict
 
-if __name__ == "__main__":
+# ########################## #
+# #### Manpage Analysis #### #
+# ########################## #
 
-    parser = argparse.ArgumentParser(description='''
-    CarpetFuzz - an NLP-based fuzzing assitance tool for generating valid option combinations.
-        find_relationship.py - find relationships between options from the manual file.
-    ''', formatter_class=argparse.RawTextHelpFormatter)
-    parser.add_argument('--file', type=str, help = 'Input manpage file (groff format).', required=True)
-
-    args = parser.parse_args()
-
-    input_path = args.file
-
-    # Parsing groff file
-    program, opt_desc_dict = groff_util.parseGroff(input_path)
+# Return the relation data and the program name of a manpage.
+# If the manpage cannot be analyzed, return None for the data and the reason instead of the program name.
+def analyzeManpage(input_path, content=None):
+    # Parsing groff file, which returns -1 if the manpage cannot be read and 1 if it has no option section
+    parse_result = groff_util.parseGroff(input_path, content)
+    if parse_result == -1:
+        return None, "Failed to read %s" % input_path
+    elif parse_result == 1:
+        return None, "No option section is found in %s" % input_path
+    program, opt_desc_dict = parse_result
     if len(opt_desc_dict) == 0:
-        print("[ERROR] Failed to parse %s" % input_path )
-        exit(0)
+        return None, "No option is found in %s" % input_path
+
+    # The shared docs of the previous manpage are not needed anymore
+    getNLPUtil().clearDocs()
 
     # Remove quotations
     opt_desc_dict = nlp_util.removeQuotationsInOptDescDict(opt_desc_dict)
@@ -103,24 +233,222 @@ if __name__ == "__main__":
     # Obtain all options list
     option_list = nlp_util.getOptList(opt_desc_dict, alias_dict, True)
 
-    # Identify R-sentences
-    explicit_rsent_list, explicit_non_rsent_list = identifyExplicitRSentences(program, opt_desc_dict, alias_dict, option_list)
-    implicit_rsent_list = identifyImplicitRSentences(program, opt_desc_dict)
+    # Identify R-sentences, the options whose descriptions are unchanged since the previous run reuse their R-sentences
+    explicit_rsent_list, implicit_rsent_list, record = identifyRSentencesIncrementally(program, opt_desc_dict, alias_dict, option_list)
 
     # Extract relationship
     relationship_dict = extractRelationships(explicit_rsent_list, implicit_rsent_list, alias_dict, option_list)
 
-    # Construct and save relation.json file
+    # Construct relation.json content
     option_list_without_alias = nlp_util.getOptList(opt_desc_dict, alias_dict, False)
     output_dict = constructOutputDict(option_list_without_alias, relationship_dict)
 
+    saveOptionRecord(program, record)
+
+    return output_dict, program
+
+def getRelationStamp():
+    global relation_stamp
+    if relation_stamp is None:
+        stamp_list = [getModelStamp(constituency_model_path)]
+        # Like the parse cache, the models are identified by their path, size and mtime instead of hashing hundreds of MB
+        for model_path in [sent2vec_model_path, xgb_model_path, wordnet_index_path]:
+            if os.path.exists(model_path):
+                model_stat = os.stat(model_path)
+                stamp_list.append("%s:%d:%d" % (os.path.abspath(model_path), model_stat.st_size, int(model_stat.st_mtime)))
+        for code_path in code_path_list:
+            if os.path.exists(code_path):
+                with open(code_path, "rb") as f:
+                    stamp_list.append(md5(f.read()).hexdigest())
+        relation_stamp = md5("|".join(stamp_list).encode("utf-8")).hexdigest()
+    return relation_stamp
+
+# Return the raw bytes of a manpage, None if it cannot be read (then the analysis reports the error)
+def readManpageContent(input_path):
+    try:
+        return groff_util.readManpage(input_path)
+    except read_errors:
+        return None
+
+def getRelationCacheKey(content):
+    if content is None:
+        return None
+    return "relation:%s:%s" % (getRelationStamp(), md5(content).hexdigest())
+
+def getCachedRelation(cache_key):
+    if cache_key is None or force_analysis or relation_cache_util.max_size <= 0:
+        return None
+    return relation_cache_util.getJson(cache_key)
+
+# Same as analyzeManpage, but byte-identical manpages are not analyzed again. Return the relation data, the program name (or the reason of the failure) and if it is a cache hit.
+def analyzeManpageCached(input_path):
+    # The manpage is read (and decompressed) once, for both the cache key and the parser
+    content = readManpageContent(input_path)
+    cache_key = getRelationCacheKey(content)
+    cached_relation = getCachedRelation(cache_key)
+    if cached_relation is not None:
+        return cached_relation["relation"], cached_relation["program"], True
+
+    output_dict, program = analyzeManpage(input_path, content)
+    if output_dict is not None and cache_key is not None:
+        relation_cache_util.putJson(cache_key, {"program": program, "relation": output_dict})
+    return output_dict, program, False
+
+def saveRelationFile(program, output_dict):
     if not os.path.exists(output_dir):
         os.mkdir(output_dir)
-        
-    with open("%s/relation_%s.json" % (output_dir, program), "w") as f:
+
+    relation_path = "%s/relation_%s.json" % (output_dir, program)
+    with open(relation_path, "w") as f:
         f.write(json.dumps(output_dict))
 
-    print("[OK] Successfully generate the relationship file - %s/relation_%s.json" % (output_dir, program))
-    
+    return relation_path
 
-    
+# ###################### #
+# #### Batch Analysis #### #
+# ###################### #
+
+def analyzeManpageResult(input_path):
+    # A failure in one manpage must not abort the rest of the batch
+    try:
+        output_dict, program, cached = analyzeManpageCached(input_path)
+        if output_dict is None:
+            return {"file": input_path, "status": "error", "message": program}
+        relation_path = saveRelationFile(program, output_dict)
+    except (Exception, SystemExit) as e:
+        return {"file": input_path, "status": "error", "message": "%s: %s" % (type(e).__name__, e)}
+    return {"file": input_path, "status": "ok", "program": program, "relation": relation_path, "cached": cached}
+
+def initBatchWorker():
+    # Each worker runs its own inference, so do not let torch spawn a thread per core in every worker
+    import torch
+    torch.set_num_threads(1)
+    # The pool workers are daemonic and cannot have children, so nlp.pipe runs in the worker itself
+    global pipe_process_num
+    pipe_process_num = 1
+    if nlp_util is not None:
+        nlp_util.pipe_process_num = 1
+
+def getBatchJobNum():
+    # The forked workers share the loaded models, but each of them may grow up to the size of this process
+    worker_memory = max(1, psutil.Process().memory_info().rss)
+    memory_job_num = psutil.virtual_memory().available // worker_memory
+    return max(1, min(os.cpu_count() or 1, memory_job_num))
+
+def analyzeManpageBatch(input_path_list, jobs=0):
+    # Load the models before forking, so that the workers inherit them instead of loading them again.
+    # They are not needed at all if every manpage is cached.
+    if not all(getCachedRelation(getRelationCacheKey(readManpageContent(input_path))) is not None for input_path in input_path_list):
+        getNLPUtil()
+        getModelUtil()
+    # The check above opens the zip archives, and the forked workers must not share their file offsets
+    groff_util.closeArchives()
+    # Create the output directory before the workers race on it
+    if not os.path.exists(output_dir):
+        os.mkdir(output_dir)
+    if jobs == 0:
+        jobs = getBatchJobNum()
+    jobs = min(jobs, len(input_path_list))
+    print("[*] Analyzing %d manpages with %d workers ..." % (len(input_path_list), jobs))
+
+    result_list = []
+    if jobs > 1:
+        if pipe_process_num > 1:
+            print("[WARN] --pipe-process is ignored with more than one job, each worker runs nlp.pipe by itself")
+        pool = multiprocessing.Pool(jobs, initializer=initBatchWorker)
+        result_iter = pool.imap(analyzeManpageResult, input_path_list)
+    else:
+        pool = None
+        result_iter = map(analyzeManpageResult, input_path_list)
+    for result in result_iter:
+        if result["status"] == "ok":
+            print("[OK] %s - %s%s" % (result["file"], result["relation"], " (cached)" if result["cached"] else ""))
+        else:
+            print("[ERROR] %s - %s" % (result["file"], result["message"]))
+        result_list.append(result)
+    if pool:
+        pool.close()
+        pool.join()
+
+    return result_list
+
+def saveIndexFile(result_list):
+    if not os.path.exists(output_dir):
+        os.mkdir(output_dir)
+
+    index_path = "%s/index.json" % output_dir
+    with open(index_path, "w") as f:
+        f.write(json.dumps(result_list, indent=4))
+
+    return index_path
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='''
+    CarpetFuzz - an NLP-based fuzzing assitance tool for generating valid option combinations.
+        find_relationship.py - find relationships between options from the manual file.
+    ''', formatter_class=argparse.RawTextHelpFormatter)
+    input_group = parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument('--file', type=str, help = 'Input manpage file (groff format), which may be compressed (.gz/.bz2/.xz) or a zip member, e.g., man.zip/man1/ls.1.')
+    input_group.add_argument('--dir', type=str, help = 'Directory of input manpage files (zip archives are expanded), analyzed in batch.')
+    input_group.add_argument('--glob', type=str, help = 'Glob pattern of input manpage files, analyzed in batch, e.g., "man1/*.1".')
+    parser.add_argument('--parse-batch', type=int, help = 'Number of sentences parsed together by the constituency parser (default=32)', default=32)
+    parser.add_argument('--pipe-batch', type=int, help = 'Number of descriptions per batch of spaCy nlp.pipe (default=256)', default=256)
+    parser.add_argument('--pipe-process', type=int, help = 'Number of processes of spaCy nlp.pipe (default=1)', default=1)
+    parser.add_argument('--parse-cache-size', type=int, help = 'Size limit of the parse cache (output/cache/parse) in MB, 0 to disable it (default=1024)', default=1024)
+    parser.add_argument('--relation-cache-size', type=int, help = 'Size limit of the relation cache (output/cache/relation) in MB, 0 to disable it (default=256)', default=256)
+    parser.add_argument('--force', help = 'Analyze the manpages again even if their relation data are cached, and do not reuse the R-sentences of the previous run', action='store_true')
+    parser.add_argument('--jobs', type=int, help = 'Number of worker processes in batch mode, 0 to size it by the cores and the available memory (default=0)', default=0)
+
+    args = parser.parse_args()
+
+    if args.parse_batch < 1:
+        print("[x] Error: The parse batch size must be positive - %d" % args.parse_batch)
+        exit(1)
+    if args.pipe_batch < 1 or args.pipe_process < 1:
+        print("[x] Error: The pipe batch size and the number of pipe processes must be positive")
+        exit(1)
+    parse_batch_size = args.parse_batch
+    pipe_batch_size = args.pipe_batch
+    pipe_process_num = args.pipe_process
+    parse_cache_size = args.parse_cache_size * 1024 * 1024
+    relation_cache_util.max_size = args.relation_cache_size * 1024 * 1024
+    force_analysis = args.force
+
+    if args.file:
+        input_path = args.file
+
+        output_dict, program, cached = analyzeManpageCached(input_path)
+        if output_dict is None:
+            print("[ERROR] %s" % program)
+            exit(0)
+
+        relation_path = saveRelationFile(program, output_dict)
+        print("[*] Relation cache: %s" % ("hit" if cached else "miss"))
+
+        print("[OK] Successfully generate the relationship file - %s" % relation_path)
+    else:
+        if args.dir:
+            if not os.path.isdir(args.dir):
+                print("[x] Error: Cannot find the directory - %s" % args.dir)
+                exit(1)
+            input_path_list = sorted([os.path.join(root, filename) for root, _, filename_list in os.walk(args.dir) for filename in filename_list])
+        else:
+            input_path_list = sorted([path for path in glob.glob(args.glob, recursive=True) if os.path.isfile(path)])
+        # Zip archives (e.g., man.zip of the Debian corpus) are read member by member without extraction
+        input_path_list = [path for input_path in input_path_list for path in groff_util.listManpages(input_path)]
+        if len(input_path_list) == 0:
+            print("[x] Error: No manpage file is found")
+            exit(1)
+        if args.jobs < 0:
+            print("[x] Error: The number of jobs must not be negative - %d" % args.jobs)
+            exit(1)
+
+        result_list = analyzeManpageBatch(input_path_list, args.jobs)
+        index_path = saveIndexFile(result_list)
+
+        failed_num = len([result for result in result_list if result["status"] != "ok"])
+        print("[*] %d of %d manpages are analyzed, %d failed" % (len(result_list) - failed_num, len(result_list), failed_num))
+        hit_num = len([result for result in result_list if result.get("cached")])
+        print("[*] Relation cache: %d hits, %d misses" % (hit_num, len(result_list) - failed_num - hit_num))
+        print("[OK] Successfully generate the index file - %s" % index_path)
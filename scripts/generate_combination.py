@@ -2,7 +2,11 @@ import argparse
 import os
 import sys
 import json
+import itertools
+import subprocess
+import numpy as np
 from utils.execution_util import ExecutionUtil
+from utils.covering_array_util import CoveringArrayUtil, MAX_STRENGTH
 
 script_dir = sys.path[0]
 project_dir = os.path.abspath(os.path.join(script_dir, ".."))
@@ -28,12 +32,13 @@ def generatePictModel(program, relation_data):
         model_content += "IF [%s] = 1 THEN [%s] <> 1;\n" % (conflict_pair[0], conflict_pair[1])
     
     for dependent_key in dependent_options:
+        # Every target is encoded, the same as ConstraintUtil which checks the generated combinations
         if "||" in dependent_options[dependent_key]:
             d = dependent_options[dependent_key].split("||")
-            model_content += "IF [%s] = 1 Then [%s] = 1 or [%s] = 1;\n" % (dependent_key, d[0], d[1])
+            model_content += "IF [%s] = 1 Then %s;\n" % (dependent_key, " or ".join(["[%s] = 1" % target for target in d]))
         elif "&&" in dependent_options[dependent_key]:
             d = dependent_options[dependent_key].split("&&")
-            model_content += "IF [%s] = 1 Then [%s] = 1 and [%s] = 1;\n" % (dependent_key, d[0], d[1])
+            model_content += "IF [%s] = 1 Then %s;\n" % (dependent_key, " and ".join(["[%s] = 1" % target for target in d]))
         else:
             model_content += "IF [%s] = 1 Then [%s] = 1;\n" % (dependent_key, dependent_options[dependent_key])
     
@@ -47,23 +52,119 @@ def generatePictModel(program, relation_data):
 
     return model_path
 
-def executePict(pict_path, model_path):
-    print("[*] Executing Pict ...")
-    cmd = "%s %s /c /o:6" % (pict_path, model_path)
-    output = execution_util.executeCommand(cmd)
-    return output
+def generatePictSeed(program, option_list, seed_row_list):
+    # Seeding file of pict: a header with the parameter names, then one tab-separated row per line
+    seed_content = "\t".join(option_list) + "\n"
+    for row in seed_row_list:
+        seed_content += "\t".join([str(label) for label in row]) + "\n"
+
+    if not os.path.exists(output_model_dir):
+        os.mkdir(output_model_dir)
+
+    seed_path = "%s/seed_%s.txt" % (output_model_dir, program)
 
-def parsePictResult(result):
+    with open(seed_path, "w") as f:
+        f.write(seed_content)
+
+    return seed_path
+
+def executePict(pict_path, model_path, strength=6, seed_path=None):
+    print("[*] Executing Pict ...")
+    cmd = "%s %s /c /o:%d" % (pict_path, model_path, strength)
+    if seed_path:
+        # Pict keeps the seed rows in its output and only adds the rows for the uncovered combinations
+        cmd += " /e:%s" % seed_path
+    # Pict's output can be hundreds of MB, so read it through the pipe line by line
+    return execution_util.executeCommandIter(cmd)
+
+def parsePictResult(line_iter):
     print("[*] Parsing Pict results ...")
-    option_list = result.splitlines()[0].split("\t")
-    combination_list = []
-    for line in result.splitlines()[1:]:
+    line_iter = iter(line_iter)
+    header = next(line_iter, None)
+    # Even a model without any row prints the header, so its absence means pict failed
+    if header is None or not header.strip():
+        raise ValueError("Pict output has no header")
+    option_list = header.rstrip("\r\n").split("\t")
+    for line in line_iter:
         combination = ""
-        for idx, label in enumerate(line.split("\t")):
+        for idx, label in enumerate(line.rstrip("\r\n").split("\t")):
             if label == "1":
                 combination += "%s " % (option_list[idx])
-        combination_list.append(combination)
-    return combination_list
+        yield combination
+
+def generateNativeCombinations(program, covering_array_util, strength=6, time_budget=0, seed_row_list=None):
+    print("[*] Generating %d-wise combinations for %s ..." % (strength, program))
+    for row in covering_array_util.generate(strength, time_budget, seed_row_list):
+        yield covering_array_util.formatCombination(row)
+
+def loadPreviousCombinations(combination_path, covering_array_util):
+    with open(combination_path, "r") as f:
+        content = f.read()
+    # saveCombinations joins the combinations with "\n", so an empty combination is an empty line
+    combination_list = content.split("\n") if content else []
+
+    # Options removed from the relation file are dropped from the rows
+    constraint_util = covering_array_util.constraint_util
+    packed_array = constraint_util.packCombinations(combination_list)
+    # Only keep the rows that still satisfy the (new) constraints
+    valid_array = constraint_util.validate(packed_array, len(combination_list))
+    row_array = np.unpackbits(packed_array.view(np.uint8), axis=1, bitorder="little").T[:len(combination_list)]
+    seed_row_list = row_array[valid_array].tolist()
+    print("[*] %d of %d previous combinations are kept" % (len(seed_row_list), len(combination_list)))
+    return seed_row_list
+
+def filterCombinations(combination_iter, constraint_util, chunk_size=65536):
+    # Check the rows in chunks with the compiled constraints, since pict output is not verified otherwise
+    invalid_num = 0
+    combination_iter = iter(combination_iter)
+    while True:
+        chunk_list = list(itertools.islice(combination_iter, chunk_size))
+        if len(chunk_list) == 0:
+            break
+        valid_array = constraint_util.validateCombinations(chunk_list)
+        invalid_num += len(chunk_list) - int(valid_array.sum())
+        for combination, valid in zip(chunk_list, valid_array):
+            if valid:
+                yield combination
+    if invalid_num > 0:
+        print("[WARN] %d combinations violating the constraints are dropped" % invalid_num)
+
+def chooseStrength(covering_array_util, engine, time_budget=0, memory_budget=0, strength=None):
+    option_num = len(covering_array_util.option_list)
+    constraint_num = len(covering_array_util.conflict_list) + len(covering_array_util.dependent_list)
+
+    # A fixed strength is only reported, otherwise choose the highest strength that fits in the budgets
+    strength_list = [strength] if strength else range(1, min(MAX_STRENGTH, max(1, option_num)) + 1)
+    chosen_strength = 1
+    for t in strength_list:
+        row_num, runtime, memory = covering_array_util.estimateCost(t, engine)
+        print("[*] Estimate of %d-wise (%d options, %d constraints): ~%d combinations, ~%.1fs, ~%.1f MB" % (t, option_num, constraint_num, row_num, runtime, memory / (1 << 20)))
+        if strength:
+            chosen_strength = t
+        elif (time_budget <= 0 or runtime <= time_budget) and (memory_budget <= 0 or memory <= memory_budget):
+            chosen_strength = t
+        else:
+            break
+    return chosen_strength
+
+def saveCombinations(combination_iter, combination_path):
+    # Write into a temporary file and only replace the combination file once the generation finished,
+    # so that a failed run never truncates the previous combinations
+    temp_path = "%s.tmp" % combination_path
+    combination_num = 0
+    try:
+        with open(temp_path, "w") as f:
+            for combination in combination_iter:
+                # Same layout as "\n".join(combination_list), without materializing the list
+                if combination_num > 0:
+                    f.write("\n")
+                f.write(combination)
+                combination_num += 1
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    os.replace(temp_path, combination_path)
+    return combination_num
 
 if __name__ == "__main__":
 
@@ -73,36 +174,78 @@ if __name__ == "__main__":
     ''', formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('--relation', type=str, help = 'Path to input relation file (json format).', required=True)
     parser.add_argument('--pict', type=str, help = 'Path to the ELF file of pict (default=pict/build/cli/pict)', default=os.path.join(project_dir, "pict/build/cli/pict"))
+    parser.add_argument('--engine', type=str, help = 'Generate combinations with pict or the built-in generator (default=pict)', choices=["pict", "native"], default="pict")
+    parser.add_argument('--strength', type=str, help = 'Strength of the combinations, i.e., t-wise, or "auto" to choose the highest strength that fits in the budgets (default=6)', default="6")
+    parser.add_argument('--time-budget', type=int, help = 'Time budget in seconds, used by the auto strength and to stop the built-in generator, 0 for unlimited (default=0)', default=0)
+    parser.add_argument('--incremental', help = 'Keep the valid combinations of the previous combination file and only generate the missing ones', action='store_true')
+    parser.add_argument('--memory-budget', type=int, help = 'Memory budget in MB, used by the auto strength, 0 for unlimited (default=0)', default=0)
 
     args = parser.parse_args()
 
     relation_path = args.relation
     pict_path = args.pict
+    engine = args.engine
+    strength = args.strength
+    time_budget = args.time_budget
+    memory_budget = args.memory_budget
+    incremental = args.incremental
 
     if not os.path.exists(relation_path):
         print("[x] Error: Cannot find the relation file - %s" % relation_path)
         exit(1)
-    if not os.path.exists(pict_path):
+    if engine == "pict" and not os.path.exists(pict_path):
         print("[x] Error: Cannot find the ELF file of pict - %s" % pict_path)
         exit(1)
+    if strength != "auto":
+        if not strength.isdigit() or int(strength) < 1 or (engine == "native" and int(strength) > MAX_STRENGTH):
+            print("[x] Error: Unsupported strength - %s" % strength)
+            exit(1)
+        strength = int(strength)
 
     with open("%s" % relation_path, "r") as f:
         relation_data = json.loads(f.read())
 
     program = relation_path.split("_")[1][:-5]
-    
-    model_path = generatePictModel(program, relation_data)
 
-    result = executePict(pict_path, model_path)
-
-    combination_list = parsePictResult(result)
+    options = relation_data['options']['total_options']
+    conflict_options = relation_data['options']['conflict_options']
+    dependent_options = relation_data['options']['dependent_options']
+    covering_array_util = CoveringArrayUtil(options, conflict_options, dependent_options)
 
+    # Report the estimated size and cost before running
+    strength = chooseStrength(covering_array_util, engine, time_budget, memory_budget * (1 << 20), None if strength == "auto" else strength)
+    print("[*] Use the strength %d" % strength)
+    
     if not os.path.exists(output_combination_dir):
         os.mkdir(output_combination_dir)
-    
-    with open(os.path.join(output_combination_dir, "combination_%s.txt" % (program)), "w") as f:
-        f.write("\n".join(combination_list))
+    combination_path = os.path.join(output_combination_dir, "combination_%s.txt" % (program))
+
+    # The previous combinations are loaded before the combination file is overwritten
+    seed_row_list = []
+    if incremental:
+        if os.path.exists(combination_path):
+            seed_row_list = loadPreviousCombinations(combination_path, covering_array_util)
+        else:
+            print("[INFO] Cannot find the previous combination file, generate from scratch - %s" % combination_path)
+
+    if engine == "pict":
+        model_path = generatePictModel(program, relation_data)
+        seed_path = generatePictSeed(program, options, seed_row_list) if seed_row_list else None
+        # Pict output is decoded and written row by row, so the peak memory does not grow with the number of combinations
+        line_iter = executePict(pict_path, model_path, strength, seed_path)
+        combination_iter = filterCombinations(parsePictResult(line_iter), covering_array_util.constraint_util)
+    else:
+        combination_iter = generateNativeCombinations(program, covering_array_util, strength, time_budget, seed_row_list)
+    try:
+        combination_num = saveCombinations(combination_iter, combination_path)
+    except subprocess.CalledProcessError as e:
+        print("[x] Error: Pict exited with the return code %d" % e.returncode)
+        exit(1)
+    except ValueError as e:
+        print("[x] Error: %s" % e)
+        exit(1)
 
+    print("[*] %d combinations are generated" % combination_num)
     print("[OK] Successfully generate the combination file - %s/combination_%s.json" % (output_combination_dir, program))
     
     
\ No newline at end of file
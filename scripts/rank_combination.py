@@ -3,26 +3,24 @@
 
 import sys
 import os
-import re
 import json
 import random
 import argparse
-from hashlib import md5
-from utils.execution_util import ExecutionUtil
+from utils.coverage_util import CoverageUtil
+from utils.constraint_util import ConstraintUtil
 
 script_dir = sys.path[0]
 project_dir = os.path.abspath(os.path.join(script_dir, ".."))
 output_dir = os.path.join(project_dir, "output/stubs")
+cache_dir = os.path.join(project_dir, "output/cache/coverage")
 
-execution_util = ExecutionUtil()
-
-def restoreStub(combination, dict_data):
+def restoreStub(combination, dict_data, rng=random):
     synopsis = dict_data["synopsis"]
 
     new_combination = ""
     for opt in combination.split(" "):
         if opt in dict_data["options"]:
-            value = random.choice(dict_data["options"][opt])
+            value = rng.choice(dict_data["options"][opt])
             if value.startswith("="):
                 new_combination += "%s=%s " % (opt, value)
             elif value.startswith("*"):
@@ -33,43 +31,40 @@ def restoreStub(combination, dict_data):
             new_combination += "%s " % (opt)
     
     if "SUB" in synopsis and "SUB" in dict_data["options"]:
-        sub_command = random.choice(dict_data["options"]["SUB"])
+        sub_command = rng.choice(dict_data["options"]["SUB"])
         synopsis = synopsis.replace("SUB", sub_command)
     
     stub = synopsis.replace("OPTIONS", new_combination)
     return stub
 
-def getDryRunCoverage(stub, program_dir, seed_dir, showmap_path):
-    # Save stub into a temporary .argv file
-    tmpfile_path = "/tmp/.dry-run-tmpfile-%s" % (md5(stub.encode("utf-8")).hexdigest())
-    # Replace space with 0x00
-    new_stub = ' '.join(stub.split()).replace(" ", "\x00") + "\x00"
-    # Choose the first seed since it is more likely to be fuzzed in a limited time
-    new_stub = new_stub.replace("@@", os.path.join(seed_dir, os.listdir(seed_dir)[0]))
-    with open(tmpfile_path, "w") as f:
-        f.write(new_stub)
-    # Pass the temporary file to the program since it has been instrumented
-    cmd = ("%s -e -o /dev/null -- %s/%s %s" % (showmap_path, program_dir, stub.split(" ")[0], tmpfile_path))
-    # Execute
-    output = execution_util.executeCommand(cmd)
-    # Delete the temporary file
-    os.remove(tmpfile_path)
-    # Find the coverage data
-    coverage = re.compile(r'Captured (\d+) tuples').findall(output)
-    if len(coverage) == 0:
-        print("[Error] Failed to get bitmap through cmd line: %s" % cmd)
-        exit(1)
-    return int(coverage[0])
-
-def rankFromStubsFile(combination_list, dict_data, program_dir, showmap_path, seed_dir):
+def rankFromStubsFile(combination_list, dict_data, coverage_util, jobs=1, batch_size=1, random_seed=None, strategy="coverage", aggregation="union"):
 
     coverage_dict = {}
 
+    # Restore all stubs in the main process first, so that the random values are chosen in the same order as a sequential run
+    # With a random seed, each combination gets its own generator, so that its stub (and cached coverage) does not depend on other lines
+    stub_list = []
     for combination in combination_list:
-        stub = restoreStub(combination, dict_data)
-        coverage = getDryRunCoverage(stub, program_dir, seed_dir, showmap_path)
-        coverage_dict[stub] = coverage
-    stubs_ranked_list = [item[0] for item in sorted(coverage_dict.items(), key=lambda x:x[1], reverse=True)]
+        rng = random.Random("%s:%s" % (random_seed, " ".join(combination.split()))) if random_seed is not None else random
+        stub_list.append(restoreStub(combination, dict_data, rng))
+
+    # The greedy ranking needs the tuples of each stub (union over the sampled seeds), the plain ranking only their number
+    if strategy == "greedy":
+        result_list = coverage_util.getDryRunTupleList(stub_list, jobs, batch_size)
+    else:
+        result_list = coverage_util.getDryRunCoverageList(stub_list, jobs, batch_size, aggregation)
+    for stub, result in zip(stub_list, result_list):
+        if result is None:
+            exit(1)
+        coverage_dict[stub] = result
+
+    if strategy == "greedy":
+        # Put the stubs that bring the most new tuples first, so that redundant stubs do not crowd the top
+        unique_stub_list = list(coverage_dict.keys())
+        ranked_idx_list = coverage_util.rankByMarginalCoverage(list(coverage_dict.values()))
+        stubs_ranked_list = [unique_stub_list[idx] for idx in ranked_idx_list]
+    else:
+        stubs_ranked_list = [item[0] for item in sorted(coverage_dict.items(), key=lambda x:x[1], reverse=True)]
 
     return stubs_ranked_list
 
@@ -83,6 +78,15 @@ if __name__ == "__main__":
     parser.add_argument("--bindir", type=str, help='Path to instrumented ELF file.', required=True)
     parser.add_argument("--seeddir", type=str, help='Path to seed file', required=True)
     parser.add_argument("--showmap", type=str, help='Path to afl-showmap in CarpetFuzz-fuzzer (default=fuzzer/afl-showmap)', default=os.path.join(project_dir, "fuzzer/afl-showmap"))
+    parser.add_argument("--jobs", type=int, help='Number of parallel dry-run workers (default=1)', default=1)
+    parser.add_argument("--batch", type=int, help='Number of stubs measured by one afl-showmap process through its directory mode (default=1, i.e., one process per stub)', default=1)
+    parser.add_argument("--cache", type=str, help='Path to the dry-run coverage cache (default=output/cache/coverage)', default=cache_dir)
+    parser.add_argument("--cache-size", type=int, help='Size limit of the dry-run coverage cache in MB, 0 to disable it (default=1024)', default=1024)
+    parser.add_argument("--seeds", type=int, help='Number of seeds each stub is executed with (default=1, i.e., the first seed)', default=1)
+    parser.add_argument("--aggregation", type=str, help='How to aggregate the coverage over the seeds (default=union)', choices=["union", "max", "mean"], default="union")
+    parser.add_argument("--random-seed", type=str, help='Seed for choosing option values, which makes the stubs reproducible across runs (default=None)', default=None)
+    parser.add_argument("--relation", type=str, help='Path to the relation file, combinations violating its constraints are filtered out before the dry-runs (default=None)', default=None)
+    parser.add_argument("--strategy", type=str, help='Rank by the number of captured tuples (coverage) or by the new tuples over the stubs ranked before (greedy) (default=coverage)', choices=["coverage", "greedy"], default="coverage")
     args = parser.parse_args()
 
     combination_file_path = args.combination
@@ -90,6 +94,25 @@ if __name__ == "__main__":
     program_dir = args.bindir
     seed_dir = args.seeddir
     showmap_path = args.showmap
+    jobs = args.jobs
+    batch_size = args.batch
+    cache_path = args.cache
+    cache_size = args.cache_size * 1024 * 1024
+    random_seed = args.random_seed
+    seed_num = args.seeds
+    aggregation = args.aggregation
+    strategy = args.strategy
+    relation_path = args.relation
+
+    if jobs < 1:
+        print("[x] Error: The number of jobs must be positive - %d" % jobs)
+        exit(1)
+    if batch_size < 1:
+        print("[x] Error: The batch size must be positive - %d" % batch_size)
+        exit(1)
+    if seed_num < 1:
+        print("[x] Error: The number of seeds must be positive - %d" % seed_num)
+        exit(1)
 
     program = combination_file_path.split("_")[1][:-4]
     
@@ -103,7 +126,20 @@ if __name__ == "__main__":
         print("[x] Cannot find the program %s in dictionary." % (program))
         exit(1)
 
-    stubs_ranked_list = rankFromStubsFile(combination_list, dict_data[program], program_dir, showmap_path, seed_dir)
+    # Externally supplied or merged combination files may violate the constraints, do not spend dry-runs on them
+    if relation_path:
+        if not os.path.exists(relation_path):
+            print("[x] Error: Cannot find the relation file - %s" % relation_path)
+            exit(1)
+        with open(relation_path, "r") as f:
+            relation_data = json.loads(f.read())
+        constraint_util = ConstraintUtil(relation_data['options']['total_options'], relation_data['options']['conflict_options'], relation_data['options']['dependent_options'])
+        valid_array = constraint_util.validateCombinations(combination_list)
+        print("[*] %d of %d combinations violate the constraints and are filtered out" % (len(combination_list) - int(valid_array.sum()), len(combination_list)))
+        combination_list = [combination for combination, valid in zip(combination_list, valid_array) if valid]
+
+    coverage_util = CoverageUtil(program_dir, seed_dir, showmap_path, cache_path, cache_size, seed_num)
+    stubs_ranked_list = rankFromStubsFile(combination_list, dict_data[program], coverage_util, jobs, batch_size, random_seed, strategy, aggregation)
 
     if not os.path.exists(output_dir):
         os.mkdir(output_dir)
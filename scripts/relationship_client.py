@@ -0,0 +1,66 @@
+import argparse
+import json
+import os
+import sys
+import socket
+
+script_dir = sys.path[0]
+project_dir = os.path.abspath(os.path.join(script_dir, ".."))
+socket_path = "%s/output/relationship.sock" % project_dir
+
+def sendRequest(stream, request):
+    stream.write(("%s\n" % json.dumps(request)).encode("utf-8"))
+    stream.flush()
+    line = stream.readline()
+    if not line:
+        print("[x] Error: The server closed the connection")
+        exit(1)
+    return json.loads(line.decode("utf-8"))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='''
+    CarpetFuzz - an NLP-based fuzzing assitance tool for generating valid option combinations.
+        relationship_client.py - find relationships between options through a running relationship_server.py.
+    ''', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--file', type=str, nargs='+', help = 'Input manpage files (groff format).', default=[])
+    parser.add_argument('--socket', type=str, help = 'Path to the unix socket of the server (default=output/relationship.sock)', default=socket_path)
+    parser.add_argument('--shutdown', help = 'Stop the server after the manpages are analyzed', action='store_true')
+
+    args = parser.parse_args()
+
+    socket_path = args.socket
+    input_path_list = args.file
+    shutdown = args.shutdown
+
+    if len(input_path_list) == 0 and not shutdown:
+        print("[x] Error: No manpage file is given")
+        exit(1)
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except OSError:
+        print("[x] Error: Cannot connect to the server, start it with relationship_server.py first - %s" % socket_path)
+        exit(1)
+    stream = client.makefile("rwb")
+
+    failed_num = 0
+    for input_path in input_path_list:
+        # The server may run in another directory
+        response = sendRequest(stream, {"command": "analyze", "file": os.path.abspath(input_path)})
+        if response["status"] == "ok":
+            print("[OK] Successfully generate the relationship file - %s (%.1fs%s)" % (response["relation"], response["time"], ", cached" if response.get("cached") else ""))
+        else:
+            print("[ERROR] %s" % response["message"])
+            failed_num += 1
+
+    if shutdown:
+        sendRequest(stream, {"command": "shutdown"})
+        print("[*] The server is stopped")
+
+    stream.close()
+    client.close()
+
+    if failed_num > 0:
+        print("[*] %d of %d manpages failed" % (failed_num, len(input_path_list)))
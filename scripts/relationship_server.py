@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import sys
+import time
+import socket
+import socketserver
+
+script_dir = sys.path[0]
+project_dir = os.path.abspath(os.path.join(script_dir, ".."))
+socket_path = "%s/output/relationship.sock" % project_dir
+
+class RelationshipRequestHandler(socketserver.StreamRequestHandler):
+    # Each request is a json line, e.g., {"command": "analyze", "file": "/path/to/tiffcp.1"}, and so is each response
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode("utf-8"))
+            except ValueError:
+                response = {"status": "error", "message": "Invalid request"}
+            else:
+                response = self.server.handleRequest(request)
+            self.wfile.write(("%s\n" % json.dumps(response)).encode("utf-8"))
+            self.wfile.flush()
+            if self.server.stopped:
+                break
+
+class RelationshipServer(socketserver.UnixStreamServer):
+    def __init__(self, server_address, find_relationship):
+        self.find_relationship = find_relationship
+        self.stopped = False
+        socketserver.UnixStreamServer.__init__(self, server_address, RelationshipRequestHandler)
+        return
+
+    def handleRequest(self, request):
+        command = request.get("command")
+        if command == "ping":
+            return {"status": "ok"}
+        elif command == "shutdown":
+            self.stopped = True
+            return {"status": "ok"}
+        elif command == "analyze":
+            input_path = request.get("file", "")
+            start_time = time.time()
+            print("[*] Analyzing %s ..." % input_path)
+            # A failed manpage returns an error instead of taking the (warm) server down
+            result = self.find_relationship.analyzeManpageResult(input_path)
+            if result["status"] != "ok":
+                return {"status": "error", "message": result["message"]}
+            return {"status": "ok", "program": result["program"], "relation": result["relation"], "cached": result["cached"], "time": time.time() - start_time}
+        return {"status": "error", "message": "Unknown command: %s" % command}
+
+def isServerRunning(path):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except OSError:
+        return False
+    finally:
+        client.close()
+    return True
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='''
+    CarpetFuzz - an NLP-based fuzzing assitance tool for generating valid option combinations.
+        relationship_server.py - keep the models of find_relationship.py resident and analyze the manpages sent by relationship_client.py.
+    ''', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--socket', type=str, help = 'Path to the unix socket of the server (default=output/relationship.sock)', default=socket_path)
+
+    args = parser.parse_args()
+
+    socket_path = args.socket
+
+    if isServerRunning(socket_path):
+        print("[x] Error: The server is already running - %s" % socket_path)
+        exit(1)
+    # Remove the socket left by a server that was killed
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    if not os.path.exists(os.path.dirname(os.path.abspath(socket_path))):
+        os.makedirs(os.path.dirname(os.path.abspath(socket_path)))
+
+    # Load spaCy, the constituency parser, and the Word2Vec and XGBoost models before accepting requests
+    print("[*] Loading models ...")
+    import find_relationship
+    find_relationship.getNLPUtil()
+    find_relationship.getModelUtil()
+
+    server = RelationshipServer(socket_path, find_relationship)
+    os.chmod(socket_path, 0o600)
+    print("[OK] Relationship server is listening on %s" % socket_path)
+    try:
+        # The models are not thread-safe, so the requests are handled one by one
+        while not server.stopped:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+    print("[*] Relationship server is stopped")
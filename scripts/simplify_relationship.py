@@ -1,25 +1,22 @@
 import argparse
 import os
-import re
 import sys
 import json
 import random
-from hashlib import md5
-from utils.execution_util import ExecutionUtil
+from utils.coverage_util import CoverageUtil
 
 script_dir = sys.path[0]
 project_dir = os.path.abspath(os.path.join(script_dir, ".."))
 output_dir = "%s/output/relation" % project_dir
+cache_dir = "%s/output/cache/coverage" % project_dir
 
-execution_util = ExecutionUtil()
-
-def restoreStub(option, dict_data):
+def restoreStub(option, dict_data, rng=random):
     synopsis = dict_data["synopsis"]
 
     new_combination = ""
 
     if option in dict_data["options"]:
-        value = random.choice(dict_data["options"][option])
+        value = rng.choice(dict_data["options"][option])
         if value.startswith("="):
             new_combination += "%s=%s " % (option, value)
         elif value.startswith("*"):
@@ -30,71 +27,64 @@ def restoreStub(option, dict_data):
         new_combination += "%s " % (option)
     
     if "SUB" in synopsis and "SUB" in dict_data["options"]:
-        sub_command = random.choice(dict_data["options"]["SUB"])
+        sub_command = rng.choice(dict_data["options"]["SUB"])
         stub = synopsis.replace("SUB", sub_command)
     
     stub = synopsis.replace("OPTIONS", new_combination)
     return stub
 
-def getDryRunCoverage(stub, program_dir, seed_dir, showmap_path):
-    # Save stub into a temporary .argv file
-    tmpfile_path = "/tmp/.dry-run-tmpfile-%s" % (md5(stub.encode("utf-8")).hexdigest())
-    # Replace space with 0x00
-    new_stub = ' '.join(stub.split()).replace(" ", "\x00") + "\x00"
-    # Choose the first seed since it is more likely to be fuzzed in a limited time
-    new_stub = new_stub.replace("@@", os.path.join(seed_dir, os.listdir(seed_dir)[0]))
-    with open(tmpfile_path, "w") as f:
-        f.write(new_stub)
-    # Pass the temporary file to the program since it has been instrumented
-    cmd = ("%s -e -o /dev/null -- %s/%s %s" % (showmap_path, program_dir, stub.split(" ")[0], tmpfile_path))
-    # Execute
-    output = execution_util.executeCommand(cmd)
-    # Delete the temporary file
-    os.remove(tmpfile_path)
-    # Find the coverage data
-    coverage = re.compile(r'Captured (\d+) tuples').findall(output)
-    if len(coverage) == 0:
-        print("[Error] Failed to get bitmap through cmd line: %s" % cmd)
-        exit(1)
-    return int(coverage[0])
-
-def rankFromStubsFile(option_list, dict_data, program_dir, showmap_path, seed_dir):
+def rankFromStubsFile(option_list, dict_data, coverage_util, jobs=1, batch_size=1, random_seed=None, aggregation="union"):
 
     coverage_dict = {}
 
+    stub_list = []
     for option in option_list:
-        stub = restoreStub(option, dict_data)
-        coverage = getDryRunCoverage(stub, program_dir, seed_dir, showmap_path)
+        rng = random.Random("%s:%s" % (random_seed, option)) if random_seed is not None else random
+        stub_list.append(restoreStub(option, dict_data, rng))
+
+    coverage_list = coverage_util.getDryRunCoverageList(stub_list, jobs, batch_size, aggregation)
+    for option, coverage in zip(option_list, coverage_list):
+        if coverage is None:
+            exit(1)
         coverage_dict[option] = coverage
     stubs_ranked_list = [item[0] for item in sorted(coverage_dict.items(), key=lambda x:x[1], reverse=True)]
 
     return stubs_ranked_list
 
-def restrictOptions(relation_data, target_number, dict_data, program_dir, showmap_path, seed_dir):
+def restrictOptions(relation_data, target_number, dict_data, coverage_util, jobs=1, batch_size=1, random_seed=None, aggregation="union"):
 
     option_list = relation_data['options']['total_options']
     if len(option_list) < target_number:
         print("[x] Error: No enough options to be restricted.")
         exit(1)
 
-    option_ranked_list = rankFromStubsFile(option_list, dict_data, program_dir, showmap_path, seed_dir)
+    option_ranked_list = rankFromStubsFile(option_list, dict_data, coverage_util, jobs, batch_size, random_seed, aggregation)
     restricted_option_list = option_ranked_list[:target_number]
 
     new_relation_data = {"options": {}}
 
+    # Adjacency index, i.e., the conflict pairs and the dependent keys of each option, in the order of the relation file
+    total_option_set = set(relation_data["options"]["total_options"])
+    conflict_idx_dict = {}
+    for idx, conflict_pair in enumerate(relation_data["options"]["conflict_options"]):
+        for opt in dict.fromkeys(conflict_pair):
+            conflict_idx_dict.setdefault(opt, []).append(idx)
+    dependent_key_dict = {}
+    for key in relation_data["options"]["dependent_options"]:
+        value = relation_data["options"]["dependent_options"][key]
+        for opt in dict.fromkeys([key, value] + value.split("&&") + value.split("||")):
+            dependent_key_dict.setdefault(opt, []).append(key)
+
     new_total_options = []
     new_conflict_options = []
     new_dependent_options = {}
     for opt in restricted_option_list:
-        if opt in relation_data["options"]["total_options"]:
+        if opt in total_option_set:
             new_total_options.append(opt)
-        for conflict_pair in relation_data["options"]["conflict_options"]:
-            if opt in conflict_pair:
-                new_conflict_options.append(conflict_pair)
-        for key in relation_data["options"]["dependent_options"]:
-            value = relation_data["options"]["dependent_options"][key]
-            if opt in [key, value] + value.split("&&") + value.split("||"):
-                new_dependent_options[key] = relation_data["options"]["dependent_options"][key]
+        for idx in conflict_idx_dict.get(opt, []):
+            new_conflict_options.append(relation_data["options"]["conflict_options"][idx])
+        for key in dependent_key_dict.get(opt, []):
+            new_dependent_options[key] = relation_data["options"]["dependent_options"][key]
     
     new_relation_data = {"options": {"total_options": new_total_options, "conflict_options": new_conflict_options, "dependent_options": new_dependent_options}}
 
@@ -113,6 +103,13 @@ if __name__ == "__main__":
     parser.add_argument("--bindir", type=str, help='Path to instrumented ELF file.', required=True)
     parser.add_argument("--seeddir", type=str, help='Path to seed file', required=True)
     parser.add_argument("--showmap", type=str, help='Path to afl-showmap in CarpetFuzz-fuzzer (default=fuzzer/afl-showmap)', default=os.path.join(project_dir, "fuzzer/afl-showmap"))
+    parser.add_argument("--jobs", type=int, help='Number of parallel dry-run workers (default=1)', default=1)
+    parser.add_argument("--batch", type=int, help='Number of stubs measured by one afl-showmap process through its directory mode (default=1, i.e., one process per stub)', default=1)
+    parser.add_argument("--cache", type=str, help='Path to the dry-run coverage cache (default=output/cache/coverage)', default=cache_dir)
+    parser.add_argument("--cache-size", type=int, help='Size limit of the dry-run coverage cache in MB, 0 to disable it (default=1024)', default=1024)
+    parser.add_argument("--seeds", type=int, help='Number of seeds each stub is executed with (default=1, i.e., the first seed)', default=1)
+    parser.add_argument("--aggregation", type=str, help='How to aggregate the coverage over the seeds (default=union)', choices=["union", "max", "mean"], default="union")
+    parser.add_argument("--random-seed", type=str, help='Seed for choosing option values, which makes the stubs reproducible across runs (default=None)', default=None)
 
     args = parser.parse_args()
 
@@ -122,6 +119,23 @@ if __name__ == "__main__":
     program_dir = args.bindir
     seed_dir = args.seeddir
     showmap_path = args.showmap
+    jobs = args.jobs
+    batch_size = args.batch
+    cache_path = args.cache
+    cache_size = args.cache_size * 1024 * 1024
+    random_seed = args.random_seed
+    seed_num = args.seeds
+    aggregation = args.aggregation
+
+    if jobs < 1:
+        print("[x] Error: The number of jobs must be positive - %d" % jobs)
+        exit(1)
+    if batch_size < 1:
+        print("[x] Error: The batch size must be positive - %d" % batch_size)
+        exit(1)
+    if seed_num < 1:
+        print("[x] Error: The number of seeds must be positive - %d" % seed_num)
+        exit(1)
 
     if not os.path.exists(relation_path):
         print("[x] Error: Cannot find the relation file - %s" % relation_path)
@@ -139,7 +153,8 @@ if __name__ == "__main__":
         print("[x] Cannot find the program %s in dictionary." % (program))
         exit(1)
 
-    restricted_relation_data = restrictOptions(relation_data, target_number, dict_data[program], program_dir, showmap_path, seed_dir)
+    coverage_util = CoverageUtil(program_dir, seed_dir, showmap_path, cache_path, cache_size, seed_num)
+    restricted_relation_data = restrictOptions(relation_data, target_number, dict_data[program], coverage_util, jobs, batch_size, random_seed, aggregation)
 
     if not os.path.exists(output_dir):
         os.mkdir(output_dir)
@@ -0,0 +1,99 @@
+import os
+import json
+import tempfile
+from hashlib import md5
+
+class CacheUtil:
+    def __init__(self, cache_dir, max_size):
+        # Entries are files named by the md5 of their key, max_size (in bytes) bounds the whole directory
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.total_size = None
+        return
+
+    def get(self, key):
+        entry_path = self.__getEntryPath(key)
+        try:
+            with open(entry_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        # Refresh the mtime, which is used as the access time of the LRU eviction
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        if self.max_size <= 0:
+            return
+        entry_path = self.__getEntryPath(key)
+        entry_dir = os.path.dirname(entry_path)
+        if not os.path.exists(entry_dir):
+            os.makedirs(entry_dir, exist_ok=True)
+        if self.total_size is None:
+            self.total_size = self.__getTotalSize()
+        old_size = os.path.getsize(entry_path) if os.path.exists(entry_path) else 0
+        # Write into a temporary file first, so that concurrent readers never see a partial entry
+        fd, tmpfile_path = tempfile.mkstemp(dir=entry_dir, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmpfile_path, entry_path)
+        self.total_size += len(data) - old_size
+        if self.total_size > self.max_size:
+            self.evict()
+
+    def getJson(self, key):
+        data = self.get(key)
+        return json.loads(data.decode("utf-8")) if data is not None else None
+
+    def putJson(self, key, value):
+        self.put(key, json.dumps(value).encode("utf-8"))
+
+    # Remove the least recently used entries until the cache fits in 90% of max_size
+    def evict(self):
+        entry_list = []
+        for entry_path in self.__listEntries():
+            try:
+                stat = os.stat(entry_path)
+            except OSError:
+                continue
+            entry_list.append((stat.st_mtime, stat.st_size, entry_path))
+        entry_list.sort()
+
+        total_size = sum(item[1] for item in entry_list)
+        for _, size, entry_path in entry_list:
+            if total_size <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                continue
+            total_size -= size
+        self.total_size = total_size
+
+    def __getEntryPath(self, key):
+        digest = md5(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def __getTotalSize(self):
+        total_size = 0
+        for entry_path in self.__listEntries():
+            try:
+                total_size += os.path.getsize(entry_path)
+            except OSError:
+                continue
+        return total_size
+
+    def __listEntries(self):
+        if not os.path.exists(self.cache_dir):
+            return
+        for sub_dir in os.listdir(self.cache_dir):
+            sub_dir_path = os.path.join(self.cache_dir, sub_dir)
+            if not os.path.isdir(sub_dir_path):
+                continue
+            for filename in os.listdir(sub_dir_path):
+                if filename.startswith(".tmp-"):
+                    continue
+                yield os.path.join(sub_dir_path, filename)
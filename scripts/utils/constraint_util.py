@@ -0,0 +1,73 @@
+import numpy as np
+
+class ConstraintUtil:
+    def __init__(self, option_list, conflict_list, dependent_dict):
+        self.option_list = option_list
+        self.option_idx_dict = {opt: idx for idx, opt in enumerate(option_list)}
+
+        # Conflict: [a, b] means a and b cannot be both enabled
+        self.conflict_list = []
+        for conflict_pair in conflict_list:
+            if not all(opt in self.option_idx_dict for opt in conflict_pair):
+                print("[INFO] Skip the conflict pair with unknown options: %s" % str(conflict_pair))
+                continue
+            self.conflict_list.append((self.option_idx_dict[conflict_pair[0]], self.option_idx_dict[conflict_pair[1]]))
+
+        # Dependent: {a: "b||c"} means a requires b or c, {a: "b&&c"} means a requires b and c
+        self.dependent_list = []
+        for dependent_key in dependent_dict:
+            dependent_value = dependent_dict[dependent_key]
+            if "||" in dependent_value:
+                dependent_type, target_list = "or", dependent_value.split("||")
+            else:
+                dependent_type, target_list = "and", dependent_value.split("&&")
+            if not all(opt in self.option_idx_dict for opt in [dependent_key] + target_list):
+                print("[INFO] Skip the dependent relationship with unknown options: %s" % str({dependent_key: dependent_value}))
+                continue
+            self.dependent_list.append((self.option_idx_dict[dependent_key], dependent_type, [self.option_idx_dict[opt] for opt in target_list]))
+
+        # Every constraint is compiled into a clause "violated iff all options of A are enabled and no option of B is enabled"
+        self.clause_list = []
+        for a, b in self.conflict_list:
+            self.clause_list.append(([a, b], []))
+        for key, dependent_type, target_list in self.dependent_list:
+            if dependent_type == "or":
+                self.clause_list.append(([key], target_list))
+            else:
+                self.clause_list.extend([([key], [target]) for target in target_list])
+        return
+
+    # Pack 0/1 rows (in the order of option_list) into bit-sliced bitmasks, i.e., an (options x words) uint64 array
+    # where bit j of a word is the label of the j-th row, so each predicate checks 64 rows at once
+    def packRows(self, row_list):
+        # The number of rows is given explicitly, since reshape cannot infer it without any option
+        row_array = np.asarray(row_list, dtype=bool).reshape(len(row_list), len(self.option_list))
+        padded_array = np.zeros(((len(row_array) + 63) // 64 * 64, len(self.option_list)), dtype=bool)
+        padded_array[:len(row_array)] = row_array
+        return np.ascontiguousarray(np.packbits(padded_array, axis=0, bitorder="little").T).view(np.uint64)
+
+    # Pack combinations, i.e., lines of the combination file. Options that are not in option_list are ignored.
+    def packCombinations(self, combination_list):
+        row_array = np.zeros((len(combination_list), len(self.option_list)), dtype=bool)
+        for row_idx, combination in enumerate(combination_list):
+            for opt in combination.split():
+                opt_idx = self.option_idx_dict.get(opt)
+                if opt_idx is not None:
+                    row_array[row_idx, opt_idx] = True
+        return self.packRows(row_array)
+
+    # Return a bool array, which tells if each of the first row_num packed rows satisfies all constraints
+    def validate(self, packed_array, row_num):
+        violated_array = np.zeros(packed_array.shape[1], dtype=np.uint64)
+        for all_idx_list, any_idx_list in self.clause_list:
+            clause_array = np.bitwise_and.reduce(packed_array[all_idx_list], axis=0)
+            if any_idx_list:
+                clause_array &= ~np.bitwise_or.reduce(packed_array[any_idx_list], axis=0)
+            violated_array |= clause_array
+        return ~np.unpackbits(violated_array.view(np.uint8), bitorder="little")[:row_num].astype(bool)
+
+    def validateRows(self, row_list):
+        return self.validate(self.packRows(row_list), len(row_list))
+
+    def validateCombinations(self, combination_list):
+        return self.validate(self.packCombinations(combination_list), len(combination_list))
@@ -0,0 +1,234 @@
+import os
+import re
+import heapq
+import shutil
+import tempfile
+import multiprocessing
+import numpy as np
+from hashlib import md5
+from utils.cache_util import CacheUtil
+from utils.execution_util import ExecutionUtil
+
+# Number of set bits of each byte value
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+# The tuples (edge ids in the bitmap) of a dry-run are kept as a sorted array, in memory and in the cache
+TUPLE_DTYPE = np.dtype(np.uint32)
+
+class CoverageUtil:
+    def __init__(self, program_dir, seed_dir, showmap_path, cache_dir=None, cache_size=0, seed_num=1):
+        self.program_dir = program_dir
+        self.seed_dir = seed_dir
+        self.showmap_path = showmap_path
+        self.execution_util = ExecutionUtil()
+        # Cache the dry-run results with the binary hash, the seed hash and the argv
+        self.cache_util = CacheUtil(cache_dir, cache_size) if cache_dir and cache_size > 0 else None
+        self.file_hash_dict = {}
+        # List the seed directory only once. The first seeds are sampled, since they are more likely to be fuzzed in a limited time
+        self.seed_path_list = [os.path.join(seed_dir, filename) for filename in os.listdir(seed_dir)[:max(1, seed_num)]]
+        return
+
+    # Return the coverage of each stub in order (aggregated over the sampled seeds), None if the dry-run failed
+    def getDryRunCoverageList(self, stub_list, jobs=1, batch_size=1, aggregation="union"):
+        # Only the union over several seeds needs the tuples, otherwise their numbers are enough
+        count_only = aggregation != "union" or len(self.seed_path_list) == 1
+        return [self.aggregateCoverage(seed_tuple_list, aggregation) if seed_tuple_list is not None else None for seed_tuple_list in self.getDryRunResultList(stub_list, jobs, batch_size, count_only)]
+
+    # Return the captured tuples (edge ids in the bitmap) of each stub in order (union over the sampled seeds), None if the dry-run failed
+    def getDryRunTupleList(self, stub_list, jobs=1, batch_size=1):
+        return [self.mergeTuples(seed_tuple_list) if seed_tuple_list is not None else None for seed_tuple_list in self.getDryRunResultList(stub_list, jobs, batch_size)]
+
+    # Return the tuples (a sorted uint32 array) of each stub on each sampled seed, None if any of its dry-runs failed.
+    # With count_only, only the number of tuples is kept for each dry-run.
+    def getDryRunResultList(self, stub_list, jobs=1, batch_size=1, count_only=False):
+        # Each stub is executed once per sampled seed
+        task_list = [(stub, seed_path) for stub in stub_list for seed_path in self.seed_path_list]
+        tuple_list_list = [None] * len(task_list)
+
+        # Only execute the tasks that are not in the cache
+        missed_idx_list = []
+        for idx, task in enumerate(task_list):
+            data = self.cache_util.get(self.__getCacheKey(*task)) if self.cache_util else None
+            if data is not None:
+                tuple_list_list[idx] = len(data) // TUPLE_DTYPE.itemsize if count_only else np.frombuffer(data, dtype=TUPLE_DTYPE)
+            else:
+                missed_idx_list.append(idx)
+
+        missed_task_list = [task_list[idx] for idx in missed_idx_list]
+        batch_list = [missed_task_list[i:i + batch_size] for i in range(0, len(missed_task_list), batch_size)]
+
+        pool = None
+        if jobs > 1 and len(batch_list) > 1:
+            pool = multiprocessing.Pool(jobs)
+            # imap yields results in submission order, which keeps the ranking deterministic
+            result_iter = pool.imap(self.getDryRunTupleBatch, batch_list, chunksize=max(1, len(batch_list) // (jobs * 16)))
+        else:
+            result_iter = map(self.getDryRunTupleBatch, batch_list)
+
+        # Handle the results batch by batch, so that only the kept ones (tuples or numbers) stay in memory
+        missed_pos, failed = 0, False
+        for result in result_iter:
+            for tuple_list in result:
+                idx = missed_idx_list[missed_pos]
+                missed_pos += 1
+                if tuple_list is None:
+                    failed = True
+                    continue
+                # The cache is only written by the main process
+                if self.cache_util:
+                    self.cache_util.put(self.__getCacheKey(*task_list[idx]), tuple_list.tobytes())
+                tuple_list_list[idx] = len(tuple_list) if count_only else tuple_list
+            # Stop early, since the caller cannot rank with a failed dry-run anyway
+            if failed:
+                break
+
+        if pool:
+            if failed:
+                pool.terminate()
+            else:
+                pool.close()
+            pool.join()
+
+        if self.cache_util:
+            hit_num = len(task_list) - len(missed_idx_list)
+            print("[*] Dry-run cache: %d hits, %d misses" % (hit_num, len(missed_idx_list)))
+
+        # Group the results of the same stub
+        seed_num = len(self.seed_path_list)
+        result_list = []
+        for i in range(len(stub_list)):
+            seed_tuple_list = tuple_list_list[i * seed_num:(i + 1) * seed_num]
+            result_list.append(seed_tuple_list if all(tuple_list is not None for tuple_list in seed_tuple_list) else None)
+        return result_list
+
+    # The elements of seed_tuple_list are tuple arrays, or the numbers of tuples if only they are kept
+    def aggregateCoverage(self, seed_tuple_list, aggregation="union"):
+        tuple_num_list = [tuple_list if isinstance(tuple_list, int) else len(tuple_list) for tuple_list in seed_tuple_list]
+        if aggregation == "union":
+            return len(self.mergeTuples(seed_tuple_list)) if len(seed_tuple_list) > 1 else tuple_num_list[0]
+        elif aggregation == "max":
+            return max(tuple_num_list)
+        elif aggregation == "mean":
+            return sum(tuple_num_list) / len(tuple_num_list)
+        raise ValueError("Unknown aggregation: %s" % aggregation)
+
+    def mergeTuples(self, seed_tuple_list):
+        if len(seed_tuple_list) == 1:
+            return seed_tuple_list[0]
+        return np.unique(np.concatenate(seed_tuple_list))
+
+    def getDryRunTuples(self, stub, seed_path):
+        # Save stub into a temporary .argv file, unique per call since workers may run the same stub concurrently
+        fd, tmpfile_path = tempfile.mkstemp(prefix=".dry-run-tmpfile-")
+        with os.fdopen(fd, "w") as f:
+            f.write(self.__formatStubArgv(stub, seed_path))
+        # Keep the bitmap, since the ranking may need the tuples rather than their number
+        fd, map_path = tempfile.mkstemp(prefix=".dry-run-map-")
+        os.close(fd)
+        # Pass the temporary file to the program since it has been instrumented
+        cmd = ("%s -e -o %s -- %s/%s %s" % (self.showmap_path, map_path, self.program_dir, stub.split(" ")[0], tmpfile_path))
+        # Execute
+        output = self.execution_util.executeCommand(cmd)
+        # Find the coverage data
+        coverage = re.compile(r'Captured (\d+) tuples').findall(output)
+        tuple_list = self.__readBitmap(map_path) if len(coverage) > 0 else None
+        # Delete the temporary files
+        os.remove(tmpfile_path)
+        os.remove(map_path)
+        if tuple_list is None:
+            print("[Error] Failed to get bitmap through cmd line: %s" % cmd)
+            # Let the caller exit, since a worker process cannot terminate the whole pool
+            return None
+        return tuple_list
+
+    # Execute a batch of (stub, seed_path) tasks
+    def getDryRunTupleBatch(self, task_list):
+        if len(task_list) == 1:
+            return [self.getDryRunTuples(*task_list[0])]
+
+        tuple_list_list = [None] * len(task_list)
+
+        # afl-showmap runs the target once per file of its input directory (-i), so group the stubs by their program
+        program_idx_dict = {}
+        for idx, task in enumerate(task_list):
+            program_idx_dict.setdefault(task[0].split(" ")[0], []).append(idx)
+
+        tmpdir_path = tempfile.mkdtemp(prefix=".dry-run-tmpdir-")
+        try:
+            for program_idx, program in enumerate(program_idx_dict):
+                input_dir = os.path.join(tmpdir_path, "input_%d" % program_idx)
+                map_dir = os.path.join(tmpdir_path, "map_%d" % program_idx)
+                os.mkdir(input_dir)
+                # Save each stub into its own .argv file, named by its index in the batch
+                for idx in program_idx_dict[program]:
+                    with open(os.path.join(input_dir, "%08d" % idx), "w") as f:
+                        f.write(self.__formatStubArgv(*task_list[idx]))
+                # One showmap (and forkserver) for the whole batch, each bitmap is written into map_dir
+                args = [self.showmap_path, "-e", "-i", input_dir, "-o", map_dir, "--", os.path.join(self.program_dir, program), "@@"]
+                self.execution_util.executeArgs(args)
+                for idx in program_idx_dict[program]:
+                    tuple_list_list[idx] = self.__readBitmap(os.path.join(map_dir, "%08d" % idx))
+                    if tuple_list_list[idx] is None:
+                        print("[Error] Failed to get bitmap through cmd line: %s" % " ".join(args))
+        finally:
+            shutil.rmtree(tmpdir_path, ignore_errors=True)
+
+        return tuple_list_list
+
+    # Order the stubs greedily by the number of tuples that are not covered by the stubs before them.
+    # Stubs without new tuples are ordered by their own coverage, like the plain ranking.
+    def rankByMarginalCoverage(self, tuple_list_list):
+        # Map the tuple ids into a dense range, so that each bitmap only has as many bits as the distinct tuples
+        all_tuple_array = np.unique(np.concatenate(tuple_list_list)) if tuple_list_list else np.zeros(0, dtype=TUPLE_DTYPE)
+        bitmap_matrix = np.zeros((len(tuple_list_list), (len(all_tuple_array) + 7) // 8), dtype=np.uint8)
+        for idx, tuple_list in enumerate(tuple_list_list):
+            bit_array = np.zeros(bitmap_matrix.shape[1] * 8, dtype=bool)
+            bit_array[np.searchsorted(all_tuple_array, tuple_list)] = True
+            bitmap_matrix[idx] = np.packbits(bit_array)
+
+        # Lazy greedy: the marginal coverage of a stub never grows, so a stale gain in the heap is an upper bound
+        covered_bitmap = np.zeros(bitmap_matrix.shape[1], dtype=np.uint8)
+        heap = [(-len(tuple_list), -len(tuple_list), idx) for idx, tuple_list in enumerate(tuple_list_list)]
+        heapq.heapify(heap)
+        ranked_idx_list = []
+        while heap:
+            _, neg_coverage, idx = heapq.heappop(heap)
+            gain = int(POPCOUNT_TABLE[bitmap_matrix[idx] & ~covered_bitmap].sum())
+            if heap and (-gain, neg_coverage, idx) > heap[0]:
+                heapq.heappush(heap, (-gain, neg_coverage, idx))
+                continue
+            ranked_idx_list.append(idx)
+            covered_bitmap |= bitmap_matrix[idx]
+
+        return ranked_idx_list
+
+    def __readBitmap(self, map_path):
+        if not os.path.exists(map_path):
+            return None
+        # Each line of the bitmap file is a captured tuple, i.e., "edge_id:hit_count"
+        with open(map_path, "r") as f:
+            return np.unique(np.array([int(line.split(":")[0]) for line in f if line.strip()], dtype=TUPLE_DTYPE))
+
+    def __formatStubArgv(self, stub, seed_path):
+        # Replace space with 0x00
+        new_stub = ' '.join(stub.split()).replace(" ", "\x00") + "\x00"
+        new_stub = new_stub.replace("@@", seed_path)
+        return new_stub
+
+    def __getCacheKey(self, stub, seed_path):
+        program_path = os.path.join(self.program_dir, stub.split(" ")[0])
+        argv = ' '.join(stub.split()).replace(" ", "\x00")
+        # The entries are raw uint32 arrays, so the key differs from the json entries of older versions
+        return "tuples-u32:%s:%s:%s" % (self.__getFileHash(program_path), self.__getFileHash(seed_path), argv)
+
+    def __getFileHash(self, path):
+        if path not in self.file_hash_dict:
+            file_hash = md5()
+            try:
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        file_hash.update(chunk)
+            except OSError:
+                # A missing file will fail the dry-run anyway, never share its entry
+                return "missing-%s" % path
+            self.file_hash_dict[path] = file_hash.hexdigest()
+        return self.file_hash_dict[path]
@@ -0,0 +1,213 @@
+import math
+import time
+import itertools
+import numpy as np
+from utils.constraint_util import ConstraintUtil
+
+# The 2^t value combinations of a t-subset are stored as the bits of one uint64
+MAX_STRENGTH = 6
+# Number of partial rows the backtracking search may visit before giving up a value combination
+MAX_SEARCH_NODE_NUM = 1 << 16
+
+class CoveringArrayUtil:
+    def __init__(self, option_list, conflict_list, dependent_dict):
+        self.option_list = option_list
+        # Reuse the constraints compiled by ConstraintUtil, i.e., (a, b) for conflicts and (key, "and"/"or", targets) for dependents
+        self.constraint_util = ConstraintUtil(option_list, conflict_list, dependent_dict)
+        self.conflict_list = self.constraint_util.conflict_list
+        self.dependent_list = self.constraint_util.dependent_list
+        return
+
+    # Greedily generate rows (one at a time, like pict) until every valid t-wise value combination is covered.
+    # Each row is a list of 0/1 labels in the order of option_list. Seed rows are yielded first and only the missing rows are generated.
+    def generate(self, strength, time_budget=0, seed_row_list=None):
+        option_num = len(self.option_list)
+        if strength < 1 or strength > MAX_STRENGTH:
+            raise ValueError("The strength should be between 1 and %d: %d" % (MAX_STRENGTH, strength))
+        if option_num == 0:
+            return
+        strength = min(strength, option_num)
+        start_time = time.time()
+
+        # All t-subsets of options, and the uncovered value combinations of each subset as a bitset
+        subset_array = np.array(list(itertools.combinations(range(option_num), strength)), dtype=np.int32).reshape(-1, strength)
+        uncovered_array = np.full(len(subset_array), (1 << (1 << strength)) - 1, dtype=np.uint64)
+        weight_array = (1 << np.arange(strength)).astype(np.int64)
+        # Subsets that contain each option
+        option_subset_list = [np.flatnonzero((subset_array == idx).any(axis=1)) for idx in range(option_num)]
+
+        # The combinations covered by the seed rows (e.g., kept from a previous run) need no new rows
+        for row in seed_row_list or []:
+            code_array = (np.array(row, dtype=np.int64)[subset_array] * weight_array).sum(axis=1)
+            uncovered_array &= ~(np.uint64(1) << code_array.astype(np.uint64))
+            yield row
+
+        # The fill order of each row is shuffled with a fixed seed, which keeps the output deterministic
+        rng = np.random.RandomState(0)
+        infeasible_num = 0
+        give_up_num = 0
+        while True:
+            uncovered_idx_list = np.flatnonzero(uncovered_array)
+            if len(uncovered_idx_list) == 0:
+                break
+            if time_budget and time.time() - start_time > time_budget:
+                print("[WARN] Time budget exceeded, %d subsets are not fully covered" % len(uncovered_idx_list))
+                break
+
+            # Start a new row from the first uncovered value combination
+            subset_idx = uncovered_idx_list[0]
+            bitset = int(uncovered_array[subset_idx])
+            code = (bitset & -bitset).bit_length() - 1
+            row = [-1] * option_num
+            for j, opt_idx in enumerate(subset_array[subset_idx]):
+                row[opt_idx] = (code >> j) & 1
+            row = self.__propagate(row)
+            if row is None:
+                # The value combination violates the constraints, so it never needs to be covered
+                uncovered_array[subset_idx] &= np.uint64(~(1 << code) & 0xFFFFFFFFFFFFFFFF)
+                infeasible_num += 1
+                continue
+            start_row = row
+
+            # Fill the remaining options with the value covering the most uncovered combinations
+            for opt_idx in rng.permutation(option_num).tolist():
+                if row[opt_idx] != -1:
+                    continue
+                candidate_list = []
+                for value in [1, 0]:
+                    new_row = self.__propagate(row[:opt_idx] + [value] + row[opt_idx + 1:])
+                    if new_row is not None:
+                        candidate_list.append((self.__countNewCombinations(new_row, opt_idx, subset_array, uncovered_array, weight_array, option_subset_list), value, new_row))
+                if len(candidate_list) == 0:
+                    row = None
+                    break
+                # Prefer the larger gain, and the enabled option on ties
+                row = max(candidate_list, key=lambda x: (x[0], x[1]))[2]
+            if row is None:
+                # Unit propagation is incomplete for "or" dependents, so the greedy choices can reach a dead end
+                # even if the starting combination is satisfiable. Search for a full row by backtracking instead.
+                row = self.__search(start_row)
+                if not row:
+                    uncovered_array[subset_idx] &= np.uint64(~(1 << code) & 0xFFFFFFFFFFFFFFFF)
+                    if row is None:
+                        infeasible_num += 1
+                    else:
+                        give_up_num += 1
+                    continue
+
+            row_array = np.array(row, dtype=np.int64)
+            code_array = (row_array[subset_array] * weight_array).sum(axis=1)
+            uncovered_array &= ~(np.uint64(1) << code_array.astype(np.uint64))
+            yield row
+
+        if infeasible_num > 0:
+            print("[INFO] %d value combinations are skipped since they violate the constraints" % infeasible_num)
+        if give_up_num > 0:
+            print("[WARN] %d value combinations are not covered since the search gave up after %d partial rows" % (give_up_num, MAX_SEARCH_NODE_NUM))
+
+    # Rough estimate of the number of rows, the runtime (seconds) and the peak memory (bytes) of a t-wise covering array.
+    # The constants are measured on the built-in generator, pict is assumed to be about 10x faster per operation.
+    def estimateCost(self, strength, engine="native"):
+        option_num = len(self.option_list)
+        strength = min(strength, option_num)
+        if strength < 1:
+            return 0, 0.0, 0
+        constraint_num = len(self.conflict_list) + len(self.dependent_list)
+        subset_num = self.__comb(option_num, strength)
+        # Greedy upper bound: each row covers at least 1/2^t of the uncovered value combinations
+        row_num = int(math.ceil((1 << strength) * math.log(subset_num * (1 << strength) + 1)))
+        # and never more rows than all the assignments
+        if option_num < 64:
+            row_num = min(row_num, 1 << option_num)
+        # Each assignment scores 2 values over the subsets that contain the option
+        call_num = row_num * option_num * 2
+        work_num = call_num * (self.__comb(option_num - 1, strength - 1) + constraint_num)
+        if engine == "native":
+            runtime = call_num * 1e-5 + work_num * 6.5e-8
+            memory = subset_num * (8 + 28 * strength)
+        else:
+            runtime = work_num * 6.5e-9
+            memory = subset_num * (8 * (1 << strength) + 64)
+        return row_num, runtime, memory
+
+    def formatCombination(self, row):
+        return "".join(["%s " % self.option_list[idx] for idx, label in enumerate(row) if label == 1])
+
+    # math.comb is not available before Python 3.8
+    def __comb(self, n, k):
+        if k < 0 or k > n:
+            return 0
+        return math.factorial(n) // (math.factorial(k) * math.factorial(n - k))
+
+    # Unit propagation of the constraints over a partial row (-1 for unassigned). Return None on violation.
+    def __propagate(self, row):
+        changed = True
+        while changed:
+            changed = False
+            for a, b in self.conflict_list:
+                if row[a] == 1 and row[b] == 1:
+                    return None
+                elif row[a] == 1 and row[b] == -1:
+                    row[b] = 0
+                    changed = True
+                elif row[b] == 1 and row[a] == -1:
+                    row[a] = 0
+                    changed = True
+            for key, dependent_type, target_list in self.dependent_list:
+                target_value_list = [row[target] for target in target_list]
+                if dependent_type == "and":
+                    if 0 in target_value_list:
+                        if row[key] == 1:
+                            return None
+                        elif row[key] == -1:
+                            row[key] = 0
+                            changed = True
+                    elif row[key] == 1 and -1 in target_value_list:
+                        for target in target_list:
+                            row[target] = 1
+                        changed = True
+                else:
+                    if 1 in target_value_list:
+                        continue
+                    unassigned_list = [target for target in target_list if row[target] == -1]
+                    if len(unassigned_list) == 0:
+                        if row[key] == 1:
+                            return None
+                        elif row[key] == -1:
+                            row[key] = 0
+                            changed = True
+                    elif len(unassigned_list) == 1 and row[key] == 1:
+                        row[unassigned_list[0]] = 1
+                        changed = True
+        return row
+
+    # Depth-first search for a full row that extends the partial row and satisfies the constraints.
+    # Return the row, None if there is no such row, or False if the search gave up after MAX_SEARCH_NODE_NUM partial rows.
+    def __search(self, row):
+        stack = [row]
+        node_num = 0
+        while stack:
+            row = stack.pop()
+            if -1 not in row:
+                return row
+            node_num += 1
+            if node_num > MAX_SEARCH_NODE_NUM:
+                return False
+            opt_idx = row.index(-1)
+            # Push 0 first, so that the enabled option is tried first like in the greedy fill
+            for value in [0, 1]:
+                new_row = self.__propagate(row[:opt_idx] + [value] + row[opt_idx + 1:])
+                if new_row is not None:
+                    stack.append(new_row)
+        return None
+
+    # Count the uncovered combinations completed by assigning opt_idx, i.e., subsets with opt_idx whose options are all assigned
+    def __countNewCombinations(self, row, opt_idx, subset_array, uncovered_array, weight_array, option_subset_list):
+        row_array = np.array(row, dtype=np.int64)
+        subset_idx_array = option_subset_list[opt_idx]
+        value_array = row_array[subset_array[subset_idx_array]]
+        assigned_mask = (value_array != -1).all(axis=1)
+        if not assigned_mask.any():
+            return 0
+        code_array = (value_array[assigned_mask] * weight_array).sum(axis=1).astype(np.uint64)
+        return int(((uncovered_array[subset_idx_array[assigned_mask]] >> code_array) & np.uint64(1)).sum())
@@ -7,7 +7,23 @@ class ExecutionUtil:
 
     def executeCommand(self, cmd):
         args = shlex.split(cmd)
+        return self.executeArgs(args)
+
+    # Execute an already splitted argument list, which saves the shlex parsing and keeps paths with spaces intact
+    def executeArgs(self, args):
         p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding="cp850", universal_newlines=True)
         stdout, _ = p.communicate()
 
-        return stdout
\ No newline at end of file
+        return stdout
+
+    # Yield the stdout line by line, so that a large output never has to be held in memory.
+    # A non-zero return code raises CalledProcessError once the output is consumed.
+    def executeCommandIter(self, cmd):
+        args = shlex.split(cmd)
+        p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding="cp850", universal_newlines=True)
+        with p.stdout:
+            for line in p.stdout:
+                yield line
+        p.wait()
+        if p.returncode != 0:
+            raise subprocess.CalledProcessError(p.returncode, args)
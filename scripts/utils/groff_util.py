@@ -1,3 +1,16 @@
+import bz2
+import codecs
+import gzip
+import os
+import re
+import zipfile
+import zlib
+try:
+    import lzma
+except ImportError:
+    # Python may be built without liblzma, then .xz manpages cannot be read
+    lzma = None
+
 opt_ignores = ['"', '.RS']
 desc_ignores = ['.IX', '.PD', '.SS', '.RE', '.RS', '.Vb', '.PD', '.UNINDENT', 'INDENT', '.sp', '.']
 escape_ch = ['-', '_', '"', ' ', '\\', ".", "'", "´", "`", '.', '\'']
@@ -9,24 +22,98 @@ special_chars = {
     "Do": "$", "Eu": "€", "Po": "£", "aq": "'", "bu": "•", "co": "©", "cq": "’", "ct": "¢", "dd": "‡", "de": "°", "dg": "†", "dq": "\"", "em": "—", "en": "–", "hy": "‐", "lq": "“", "oq": "‘", "rg": "®", "rq": "”", "rs": "\\", "sc": "§", "tm": "™", "ul": "_", "==": "≡", ">=": "≥", "<=": "≤", "!=": "≠", "->": "→", "<-": "←", "+-": "±"
 }
 
+# Magic numbers of the compressed manpages, e.g., ls.1.gz
+gzip_magic, bz2_magic, xz_magic = b"\x1f\x8b", b"BZh", b"\xfd7zXZ\x00"
+# Errors of reading a broken file, archive or compressed stream
+read_errors = (OSError, EOFError, KeyError, zipfile.BadZipFile, zlib.error) + ((lzma.LZMAError,) if lzma else ())
+# Emacs-style coding tag in the first two lines, e.g., '\" -*- coding: latin-1 -*-, which is also recognized by preconv
+coding_pattern = re.compile(br"coding[:=]\s*([-\w.]+)")
+
+# Characters that need to be handled in a line, i.e., keywords, escape sequences and ignored chars. The others are copied as they are.
+opt_special_pattern = re.compile(r'[.\\"]')
+desc_special_pattern = re.compile(r'[.\\]')
+
 class GroffUtil:
-    def __init__(self):
+    def __init__(self, engine="tokenizer"):
+        # "tokenizer" copies runs of plain chars at once, "legacy" walks every char. Both give the same output.
+        if engine not in ["tokenizer", "legacy"]:
+            raise ValueError("Unknown groff parser engine: %s" % engine)
+        self.engine = engine
+        # Opened zip archives, so that the central directory of a large corpus (e.g., man.zip) is read only once
+        self.zip_dict = {}
         return
 
-    def parseGroff(self, groff_path):
+    # List the manpages in a zip archive as "<archive>/<member>" paths, which can be passed to parseGroff.
+    # The archive is not kept open, since the file offset would be shared with the forked batch workers.
+    def listManpages(self, path):
+        if not zipfile.is_zipfile(path):
+            return [path]
+        with zipfile.ZipFile(path) as zip_file:
+            return ["%s/%s" % (path, info.filename) for info in zip_file.infolist() if not info.filename.endswith("/")]
+
+    # Read the content of a manpage, which may be compressed (gzip, bz2 or xz) and/or a member of a zip archive.
+    # The file is decompressed as a stream, nothing is extracted to the disk.
+    def readManpage(self, groff_path):
+        archive_path, member = self.__splitArchivePath(groff_path)
+        if archive_path:
+            stream = self.__getZipFile(archive_path).open(member)
+        else:
+            stream = open(groff_path, "rb")
+        with stream:
+            magic = stream.peek(6)[:6] if hasattr(stream, "peek") else b""
+            if magic.startswith(gzip_magic):
+                with gzip.GzipFile(fileobj=stream) as f:
+                    return f.read()
+            elif magic.startswith(bz2_magic):
+                with bz2.BZ2File(stream) as f:
+                    return f.read()
+            elif magic.startswith(xz_magic):
+                if lzma is None:
+                    raise OSError("lzma module is not available")
+                with lzma.LZMAFile(stream) as f:
+                    return f.read()
+            return stream.read()
+
+    # Close the opened zip archives, e.g., before forking workers, which must not share the file offsets of the archives
+    def closeArchives(self):
+        for zip_file in self.zip_dict.values():
+            zip_file.close()
+        self.zip_dict = {}
+
+    # Decode with the coding tag of the header if any, then UTF-8, then Latin-1 which never fails
+    def decodeManpage(self, data):
+        encoding_list = []
+        coding_match = coding_pattern.search(b"\n".join(data.split(b"\n", 2)[:2]))
+        if coding_match:
+            try:
+                encoding_list.append(codecs.lookup(coding_match.group(1).decode("ascii")).name)
+            except LookupError:
+                pass
+        encoding_list += ["utf-8", "latin-1"]
+        for encoding in encoding_list:
+            try:
+                return data.decode(encoding)
+            except UnicodeDecodeError:
+                continue
+
+    # content is the raw bytes of the manpage if the caller has already read it
+    def parseGroff(self, groff_path, content=None):
         prog_name = ''
         opt_desc_dict = {}
         find_option_section = 0
         find_option, find_option_TP = 0, 0
         prev_opt, opt = '', ''
+        # Description fragments of each option, joined once at the end
+        opt_fragment_dict = {}
 
-        with open(groff_path, 'r', encoding='utf-8') as f:
-            try:
-                # Remove some unnecessary tag
-                lines = f.read().replace("\\f\\*[B-Font]", "").replace("\\f\\*[I-Font]", "").replace("\\f[]", "").splitlines()
-            except:
-                print("[ERROR] Failed to read file: %s" % groff_path)
-                return -1
+        try:
+            # Remove some unnecessary tag
+            if content is None:
+                content = self.readManpage(groff_path)
+            lines = self.decodeManpage(content).replace("\\f\\*[B-Font]", "").replace("\\f\\*[I-Font]", "").replace("\\f[]", "").splitlines()
+        except read_errors:
+            print("[ERROR] Failed to read file: %s" % groff_path)
+            return -1
         
         i = 0
         while i < len(lines):
@@ -50,7 +137,7 @@ class GroffUtil:
             elif lines[i][:3] in ['.TP', '.PP', '.RS', '.sp']:
                 find_option = 1
             elif find_option == 1:
-                line = self.__parseLine(lines[i], 'opt')
+                line = self.__parseLineByEngine(lines[i], 'opt')
                 line = self.__stripOpt(line)
                 if line[:2] == "\\-":
                     line = line[1:]
@@ -60,10 +147,10 @@ class GroffUtil:
                 if line[0] == '-':
                     prev_opt = opt
                     opt = line
-                    opt_desc_dict[opt] = ''
+                    opt_fragment_dict[opt] = []
                 elif opt:
                     # print('[WARN] special opt which start with no -, regard as desc and append to opt: %s. The desc is: ' % opt, lines[i])
-                    opt_desc_dict[opt] += " %s" % line
+                    opt_fragment_dict[opt].append(" %s" % line)
                 find_option = 0
             elif lines[i][:3] == '.IP':
                 find_option = 1
@@ -75,7 +162,7 @@ class GroffUtil:
                     i += 1
                     continue
                 else:
-                    line = self.__parseLine(line_split[1], 'opt')
+                    line = self.__parseLineByEngine(line_split[1], 'opt')
                     if line == '':
                         i += 1
                         continue
@@ -83,24 +170,48 @@ class GroffUtil:
                     prev_opt = opt
                     opt = line
                     find_option = 0
-                    opt_desc_dict[opt] = ''
+                    opt_fragment_dict[opt] = []
                 elif opt:
-                    opt_desc_dict[opt] += ' ' + line
+                    opt_fragment_dict[opt].append(' ' + line)
             # elif find_option == 0:
             #     pass
             # Description parsing start
             else:
-                desc_line = self.__parseLine(lines[i], 'desc')
+                desc_line = self.__parseLineByEngine(lines[i], 'desc')
                 if opt:
-                    opt_desc_dict[opt] += ' ' + desc_line
+                    opt_fragment_dict[opt].append(' ' + desc_line)
             i += 1
 
         if find_option_section == 0:
             print("[INFO] No option section found!")
             return 1
 
+        for opt in opt_fragment_dict:
+            opt_desc_dict[opt] = "".join(opt_fragment_dict[opt])
+
         return prog_name.lower(), opt_desc_dict
 
+    # Split "<archive>.zip/<member>" into the archive and the member, or return None for a normal path
+    def __splitArchivePath(self, groff_path):
+        if os.path.isfile(groff_path):
+            return None, None
+        part_list = groff_path.split("/")
+        for idx in range(1, len(part_list)):
+            archive_path = "/".join(part_list[:idx])
+            if archive_path.lower().endswith(".zip") and os.path.isfile(archive_path):
+                return archive_path, "/".join(part_list[idx:])
+        return None, None
+
+    def __getZipFile(self, archive_path):
+        if archive_path not in self.zip_dict:
+            self.zip_dict[archive_path] = zipfile.ZipFile(archive_path)
+        return self.zip_dict[archive_path]
+
+    def __parseLineByEngine(self, raw_line, type):
+        if self.engine == "legacy":
+            return self.__parseLine(raw_line, type)
+        return self.__parseLineTokenizer(raw_line, type)
+
     def __parseLine(self, raw_line, type):
         raw_line = raw_line.strip()
         # to fix desc after .PP or .TP
@@ -218,6 +329,111 @@ class GroffUtil:
 
         return line
 
+    # Same as __parseLine, but the runs of plain chars between two special chars are copied as slices
+    # and the line is joined once, instead of growing the string char by char
+    def __parseLineTokenizer(self, raw_line, type):
+        raw_line = raw_line.strip()
+        # to fix desc after .PP or .TP
+        if raw_line[0] not in ['\\', '-', '@']:
+            type = 'desc'
+        if type == 'opt':
+            line_ignores, special_pattern = opt_ignores, opt_special_pattern
+        else:
+            line_ignores, special_pattern = desc_ignores, desc_special_pattern
+        fragment_list = [' ']
+
+        if raw_line[:3] == '.IP':
+            type = 'opt'
+            raw_line = raw_line.split('"')[1] if len(raw_line.split('"')) > 1 else ""
+
+        if type == 'desc' and (raw_line[:3] in desc_ignores or raw_line.split(' ')[0] in desc_ignores):
+            return ' '
+
+        i, end = 0, len(raw_line) - 1
+        while i < end:
+            match = special_pattern.search(raw_line, i, end)
+            if match is None:
+                fragment_list.append(raw_line[i:end])
+                i = end
+                break
+            if match.start() > i:
+                fragment_list.append(raw_line[i:match.start()])
+                i = match.start()
+            # skip keywords start with a dot.
+            if raw_line[i] == '.' and raw_line[i+1].isalpha():
+                if len(raw_line) <= 3:
+                    break
+                j = raw_line.find(' ', i + 1)
+                if j != -1:
+                    i = j - 1
+            # parse escape sequences, the same as __parseLine
+            elif raw_line[i] == '\\':
+                i += 1
+                if raw_line[i] in registered_escape_char:
+                    if raw_line[i] =='"' or raw_line[i] =='#':
+                        break
+                    elif raw_line[i] in escape_ch:
+                        fragment_list.append(raw_line[i])
+                    elif raw_line[i] == '[':
+                        i = i + raw_line[i:].find(']')
+                    elif raw_line[i] == 'f' or raw_line[i] == 'F' or raw_line[i] == '*':
+                        if raw_line[i+1].isupper():
+                            i += 1
+                        elif raw_line[i+1] == '(':
+                            i += 2
+                        elif raw_line[i+1] == '[':
+                            i = i + raw_line[i:].find(']')
+                        else:
+                            i += 1
+                    elif raw_line[i] == 's':
+                        if raw_line[i+1] == '-':
+                            i += 2
+                        else:
+                            i += 1
+                    elif raw_line[i] == 'e':
+                        fragment_list.append("\\")
+                    elif raw_line[i] == '(':
+                        if raw_line[i+1:i+3] in special_chars:
+                            fragment_list.append(special_chars[raw_line[i+1:i+3]])
+                            i += 2
+                    elif raw_line[i] in ['h', 'N', 'v', 'x', 'w', 'o', 'R', "b"]:
+                        if raw_line[i+1] == "'":
+                            i = i + 2 + raw_line[i+2:].find('\'')
+                    elif raw_line[i] in ['m', 'g']:
+                        if raw_line[i+1] == "(":
+                            i += 3
+                        elif raw_line[i+1] == "[":
+                            i = i + 1 + raw_line[i+1:].find(']')
+                        else:
+                            i += 1
+                    elif raw_line[i] == "t":
+                        fragment_list.append("   ")
+                    elif raw_line[i] in ['l', 'L']:
+                        i += 4
+                    elif raw_line[i] == "c":
+                        break
+                    elif raw_line[i] == "n":
+                        if i == end:
+                            continue
+                        elif raw_line[i+1] == "(":
+                            i += 2
+                        elif raw_line[i+1] == "[":
+                            i += 1 + raw_line[i+1:].find(']')
+                        else:
+                            i += 1
+                else:
+                    fragment_list.append(raw_line[i])
+            # skip str in line_ignores, like a quote, but reserver ". "
+            elif raw_line[i] in line_ignores and not (raw_line[i] == "." and raw_line[i+1] == " "):
+                i += 1
+            else:
+                fragment_list.append(raw_line[i])
+            i += 1
+
+        if i == end:
+            fragment_list.append(raw_line[-1])
+        return "".join(fragment_list).strip()
+
     def __stripOpt(self, opt):
         opt = opt.strip("\"").strip()
         if opt == '':
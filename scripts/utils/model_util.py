@@ -1,23 +1,30 @@
+import os
 import joblib
+import itertools
 import nltk
 import gensim
 import numpy as np
 
 
 class ModelUtil:
+    # Process-wide registry of the loaded models, keyed by their path and mtime, shared by every ModelUtil
+    model_dict = {}
+
     def __init__(self, xgb_model_path, sent2vec_model_path, feature_num, threshold):
-        self.xgb_clf = joblib.load(xgb_model_path)
-        self.sent2vec_model = gensim.models.Word2Vec.load(sent2vec_model_path)
+        self.xgb_clf = self.__loadModel(xgb_model_path, joblib.load)
+        # Only the word vectors of the Word2Vec model are needed
+        self.word_vectors = self.__loadModel(sent2vec_model_path, self.__loadKeyedVectors)
         self.num_features = feature_num
         self.threshold = threshold
         return
 
     def prediction(self, preprocessed_list):
+        if len(preprocessed_list) == 0:
+            return [], []
         preprocessed_sent_list = [item['preprocessed_sent'] for item in preprocessed_list]
         token_list = [nltk.word_tokenize(sent) for sent in preprocessed_sent_list]
-        vocabulary_dict = set(self.sent2vec_model.wv.index_to_key)
-        vector_list = [self.__average_word_vectors(tokenized_sentence, vocabulary_dict) for tokenized_sentence in token_list]
-        predicted = self.xgb_clf.predict_proba(vector_list)
+        vector_array = self.__getSentenceVectors(token_list)
+        predicted = self.xgb_clf.predict_proba(vector_array)
         prediction_list = [1 if pred[1] >= self.threshold else 0 for pred in predicted]
 
         positive_list, negative_list = [], []
@@ -32,13 +39,43 @@ class ModelUtil:
                 negative_list.append(tmp_dict)
         return positive_list, negative_list
 
-    def __average_word_vectors(self, words, vocabulary):
-        feature_vector = np.zeros((self.num_features,), dtype='float64')
-        nwords = 0
-        for word in words:
-            if word in vocabulary:
-                nwords = nwords+1
-                feature_vector = np.add(feature_vector, self.sent2vec_model.wv[word])
-        if nwords:
-            feature_vector = np.divide(feature_vector,nwords)
-        return feature_vector
\ No newline at end of file
+    # Average the word vectors of each sentence (zeros if no word is in the vocabulary) into a float32 feature matrix
+    def __getSentenceVectors(self, token_list):
+        key_to_index = self.word_vectors.key_to_index
+        idx_list_list = [[key_to_index[word] for word in words if word in key_to_index] for words in token_list]
+        count_array = np.array([len(idx_list) for idx_list in idx_list_list], dtype=np.int64)
+        feature_array = np.zeros((len(token_list), self.num_features), dtype=np.float32)
+        nonempty_mask = count_array > 0
+        if not nonempty_mask.any():
+            return feature_array
+        # Gather the vectors of all sentences into one matrix, and sum each sentence's segment in one reduction
+        flat_idx_array = np.fromiter(itertools.chain.from_iterable(idx_list_list), dtype=np.int64, count=int(count_array.sum()))
+        offset_array = (np.cumsum(count_array) - count_array)[nonempty_mask]
+        # Sum in float64 like before, XGBoost takes float32 anyway
+        sum_array = np.add.reduceat(self.word_vectors.vectors[flat_idx_array], offset_array, axis=0, dtype=np.float64)
+        feature_array[nonempty_mask] = sum_array / count_array[nonempty_mask, None]
+        return feature_array
+
+    def __loadModel(self, model_path, loader):
+        model_path = os.path.abspath(model_path)
+        key = (model_path, os.path.getmtime(model_path))
+        if key not in ModelUtil.model_dict:
+            # Drop the model loaded from an older version of the file
+            for old_key in [item for item in ModelUtil.model_dict if item[0] == model_path]:
+                del ModelUtil.model_dict[old_key]
+            ModelUtil.model_dict[key] = loader(model_path)
+        return ModelUtil.model_dict[key]
+
+    # Load the KeyedVectors memory-mapped, so that forked workers share one copy of the vector matrix.
+    # They are extracted from the Word2Vec model into "<model>.kv" once, and again when the model is newer.
+    def __loadKeyedVectors(self, sent2vec_model_path):
+        kv_path = "%s.kv" % sent2vec_model_path
+        if not os.path.exists(kv_path) or os.path.getmtime(kv_path) < os.path.getmtime(sent2vec_model_path):
+            word_vectors = gensim.models.Word2Vec.load(sent2vec_model_path).wv
+            try:
+                # The vectors are saved into their own .npy file, which can be memory-mapped
+                word_vectors.save(kv_path, separately=["vectors"])
+            except OSError as e:
+                print("[WARN] Cannot save the word vectors, load them without mmap: %s" % e)
+                return word_vectors
+        return gensim.models.KeyedVectors.load(kv_path, mmap="r")
@@ -1,19 +1,82 @@
+import os
 import re
 import string
 import nltk
 import spacy
 import lemminflect
-from nltk.corpus import wordnet
 from nltk.tree import Tree, ParentedTree
 from utils.constant import STOPWORD_LIST, CONTRACTION_MAP, GLOVE_WORD_LIST, REPLACE_ITEM_LIST, SELF_REPLACE_ITEM, ANTONYM_PREPOSITION_LIST
 from allennlp.predictors import Predictor 
+from spacy.tokens import DocBin
+from hashlib import md5
+from utils.cache_util import CacheUtil
+from utils.wordnet_util import WordNetUtil
 import networkx as nx
+from bisect import bisect_left
+
+CONTRACTION_PATTERN = re.compile('({})'.format('|'.join(CONTRACTION_MAP.keys())), flags=re.IGNORECASE | re.DOTALL)
+OPTION_PATTERN = re.compile(r"(?<=\s)-{1,2}.*?(?=\s)")
+SPACY_MODEL_NAME = "en_core_web_sm"
+# No consumer uses named entities
+SPACY_DISABLE_LIST = ["ner"]
+
+# Cached parses are only valid for the same models, so the stamp changes with the model files and versions.
+# It is built from the file stats and the package metadata, so that it is available without loading the models.
+def getModelStamp(constituency_model_path):
+    constituency_model_stat = os.stat(constituency_model_path)
+    spacy_meta = spacy.util.get_model_meta(spacy.util.get_package_path(SPACY_MODEL_NAME))
+    return md5(("%s:%d:%d|%s:%s:%s|%s" % (os.path.abspath(constituency_model_path), constituency_model_stat.st_size, int(constituency_model_stat.st_mtime), spacy_meta["name"], spacy_meta["version"], ",".join(SPACY_DISABLE_LIST), spacy.__version__)).encode("utf-8")).hexdigest()
 
 class NLPUtil:
-    def __init__(self, constituency_model_path):
-        self.nlp = spacy.load("en_core_web_sm")
+    def __init__(self, constituency_model_path, batch_size=32, cache_dir=None, cache_size=0):
+        self.nlp = spacy.load(SPACY_MODEL_NAME, disable=SPACY_DISABLE_LIST)
         self.predictor_constituency = Predictor.from_path(constituency_model_path)
+        # Number of sentences parsed together by predictConstituencyTreeList
+        self.batch_size = batch_size
+        # Number of texts per batch and number of processes of nlp.pipe in prepareDocs
+        self.pipe_batch_size = 256
+        self.pipe_process_num = 1
+        # Option index of the current program, built by __isIncludedOption
+        self.option_index = (None, set(), [])
+        # Memoized WordNet lookups
+        self.wordnet_util = WordNetUtil()
+        # Docs shared by every consumer, keyed by their text
+        self.doc_dict = {}
+        self.model_stamp = getModelStamp(constituency_model_path)
+        self.setCache(cache_dir, cache_size)
         return
+
+    # Cache the bracketed trees and the serialized spaCy docs on disk, cache_size (in bytes) 0 to disable it
+    def setCache(self, cache_dir, cache_size):
+        self.cache_util = CacheUtil(cache_dir, cache_size) if cache_dir and cache_size > 0 else None
+
+    # Process the texts with nlp.pipe in one pass, so that the consumers only look up their docs
+    def prepareDocs(self, text_list):
+        missed_text_list = []
+        for text in dict.fromkeys(text_list):
+            if text in self.doc_dict:
+                continue
+            doc = self.__getCachedDoc(text)
+            if doc is not None:
+                self.doc_dict[text] = doc
+            else:
+                missed_text_list.append(text)
+        for text, doc in zip(missed_text_list, self.nlp.pipe(missed_text_list, batch_size=self.pipe_batch_size, n_process=self.pipe_process_num)):
+            self.doc_dict[text] = doc
+            self.__putCachedDoc(text, doc)
+
+    def getDoc(self, text):
+        if text not in self.doc_dict:
+            doc = self.__getCachedDoc(text)
+            if doc is None:
+                doc = self.nlp(text)
+                self.__putCachedDoc(text, doc)
+            self.doc_dict[text] = doc
+        return self.doc_dict[text]
+
+    # Release the shared docs, e.g., after a manpage is analyzed
+    def clearDocs(self):
+        self.doc_dict = {}
     
     def isParallelStructure(self, constituency_tree_1, constituency_tree_2):
         relation_tree_1 = self.__getNodes(constituency_tree_1)
@@ -41,21 +104,36 @@ class NLPUtil:
         return shortest_path
 
     def getSynonymsAndAntonyms(self, word):
-        synonyms = []
-        antonyms = []
-        for syn in wordnet.synsets(word):
-            for l in syn.lemmas():
-                synonyms.append(l.name())
-                if l.antonyms():
-                    antonyms.append(l.antonyms()[0].name())
-        return list(set(synonyms)), list(set(antonyms))
+        return self.wordnet_util.getSynonymsAndAntonyms(word)
+
+    # Look up the synonyms and antonyms in a precomputed index (see build_wordnet_index.py) before WordNet
+    def loadWordNetIndex(self, index_path):
+        self.wordnet_util = WordNetUtil(index_path=index_path)
 
     def predictConstituencyTree(self, sent):
-        sent = sent.replace("..",".").replace("(","").replace(")","").replace("{","").replace("}","")
-        tree = self.predictor_constituency.predict(sentence=sent)['trees']
+        sent = self.__cleanSentenceForParser(sent)
+        tree = self.__getCachedTree(sent)
+        if tree is None:
+            tree = self.predictor_constituency.predict(sentence=sent)['trees']
+            self.__putCachedTree(sent, tree)
         constituency_tree = Tree.fromstring(tree)
         return constituency_tree
 
+    # Same as predictConstituencyTree, but the sentences are parsed in batches, which is much faster for ELMo on CPU
+    def predictConstituencyTreeList(self, sent_list, batch_size=None):
+        batch_size = batch_size or self.batch_size
+        sent_list = [self.__cleanSentenceForParser(sent) for sent in sent_list]
+        tree_list = [self.__getCachedTree(sent) for sent in sent_list]
+        # Only parse the sentences that are not in the cache
+        missed_idx_list = [idx for idx, tree in enumerate(tree_list) if tree is None]
+        for i in range(0, len(missed_idx_list), batch_size):
+            batch_idx_list = missed_idx_list[i:i + batch_size]
+            output_list = self.predictor_constituency.predict_batch_json([{"sentence": sent_list[idx]} for idx in batch_idx_list])
+            for idx, output in zip(batch_idx_list, output_list):
+                tree_list[idx] = output['trees']
+                self.__putCachedTree(sent_list[idx], tree_list[idx])
+        return [Tree.fromstring(tree) for tree in tree_list]
+
     def removeQuotationsInOptDescDict(self, opt_desc_dict):
         new_opt_desc_dict = {}
 
@@ -67,13 +145,14 @@ class NLPUtil:
         splitted_opt_desc_dict = {}
         alias_dict = {}
         blank_opt_list = []
+        self.prepareDocs([opt_desc_dict[opt].replace("  ", " ").strip() for opt in opt_desc_dict])
         for opt in opt_desc_dict:
             desc = opt_desc_dict[opt].replace("  ", " ").strip()
             # If the desc is empty, we combine this opt with the following opt
             if desc == "":
                 blank_opt_list.append(opt)
                 continue
-            doc = self.nlp(desc)
+            doc = self.getDoc(desc)
             topic_sentence = list(doc.sents)[0].text
 
             # Combine blank options and reset the list
@@ -147,10 +226,11 @@ class NLPUtil:
         
         formatted_list = []
 
+        self.prepareDocs([opt_desc_dict[opt].replace("  ", " ").strip() for opt in opt_desc_dict])
         for opt in opt_desc_dict:
 
             desc = opt_desc_dict[opt].replace("  ", " ").strip()
-            doc = self.nlp(desc)
+            doc = self.getDoc(desc)
 
             for sent in doc.sents:
                 if sent.text.isspace():
@@ -160,39 +240,49 @@ class NLPUtil:
         return formatted_list
 
 
-    # Extract the first sentence (topic sentence), preprocess the topic sentence, and extract predicate and object
-    def extractTopicSentList(self, program, opt_desc_dict):
-        topic_sent_list = []
+    # Extract the first sentence (topic sentence), preprocess the topic sentence, and extract predicate and object.
+    # The topic sentences are grouped by the option (key of opt_desc_dict) they come from.
+    def extractTopicSentDict(self, program, opt_desc_dict):
+        topic_sent_dict = {}
 
+        # Find the topic sentence of each option first, so that all of them are parsed in batches
+        opt_sent_list = []
+        self.prepareDocs([opt_desc_dict[opt].replace("  ", " ").strip() for opt in opt_desc_dict])
         for opt in opt_desc_dict:
 
             desc = opt_desc_dict[opt].replace("  ", " ").strip()
-            doc = self.nlp(desc)
+            doc = self.getDoc(desc)
 
             for sent in doc.sents:
                 sentence = self.preprocessIDRSentence(sent.text)
                 if sentence == "":
                     continue
-                constituency_tree = self.predictConstituencyTree(sentence)
-                simplified_tree, topic_sentence, neg_flag = self.__simplifyConstituencyTree(constituency_tree)
-                predicate, object, prt = self.__getPredAndObj(topic_sentence)
-                if neg_flag and predicate:
-                    predicate = "non_%s" % predicate 
-                # Several options are put together
-                splitted_opt_list = re.split('\||,', opt)
-                if len(splitted_opt_list) > 1:
-                    # If the subject is a plural, we regard these options as independent of each other
-                    if self.__isStartsWithDTPl(sentence):
-                        for splitted_opt in splitted_opt_list:
-                            topic_sent_list.append({"cmd": program, "option": splitted_opt.split(" ")[0], "sent": sent.text, "predicate": predicate, "object": object, "prt": prt, "tree": simplified_tree})
-                    # Else we take the first option
-                    else:
-                        topic_sent_list.append({"cmd": program, "option": splitted_opt_list[0].split(" ")[0], "sent": sent.text, "predicate": predicate, "object": object, "prt": prt, "tree": simplified_tree})
-                else:
-                    topic_sent_list.append({"cmd": program, "option": splitted_opt_list[0].split(" ")[0], "sent": sent.text, "predicate": predicate, "object": object, "prt": prt, "tree": simplified_tree})
+                opt_sent_list.append((opt, sent.text, sentence))
                 break
 
-        return topic_sent_list
+        # The simplified sentences are parsed again, in batches too
+        constituency_tree_list = self.predictConstituencyTreeList([item[2] for item in opt_sent_list])
+        simplified_result_list = [self.__simplifyConstituencyTree(constituency_tree) for constituency_tree in constituency_tree_list]
+        simplified_tree_list = self.predictConstituencyTreeList([item[0] for item in simplified_result_list])
+
+        for (opt, sent_text, sentence), (topic_sentence, neg_flag), simplified_tree in zip(opt_sent_list, simplified_result_list, simplified_tree_list):
+            predicate, object, prt = self.__getPredAndObj(topic_sentence)
+            if neg_flag and predicate:
+                predicate = "non_%s" % predicate 
+            # Several options are put together
+            splitted_opt_list = re.split('\||,', opt)
+            if len(splitted_opt_list) > 1:
+                # If the subject is a plural, we regard these options as independent of each other
+                if self.__isStartsWithDTPl(sentence):
+                    for splitted_opt in splitted_opt_list:
+                        topic_sent_dict.setdefault(opt, []).append({"cmd": program, "option": splitted_opt.split(" ")[0], "sent": sent_text, "predicate": predicate, "object": object, "prt": prt, "tree": simplified_tree})
+                # Else we take the first option
+                else:
+                    topic_sent_dict.setdefault(opt, []).append({"cmd": program, "option": splitted_opt_list[0].split(" ")[0], "sent": sent_text, "predicate": predicate, "object": object, "prt": prt, "tree": simplified_tree})
+            else:
+                topic_sent_dict.setdefault(opt, []).append({"cmd": program, "option": splitted_opt_list[0].split(" ")[0], "sent": sent_text, "predicate": predicate, "object": object, "prt": prt, "tree": simplified_tree})
+
+        return topic_sent_dict
 
     # preprocessing for model
     def preprocessing(self, formatted_list, alias_dict, all_option_list):
@@ -218,8 +308,7 @@ class NLPUtil:
                 else:
                     option_map_new[option_map[opt]] = "param_other"
 
-            contractions_pattern = re.compile('({})'.format('|'.join(CONTRACTION_MAP.keys())), flags=re.IGNORECASE | re.DOTALL)
-            expanded_sentence = contractions_pattern.sub(self.__expandMatch, preprocessed_sent)
+            expanded_sentence = CONTRACTION_PATTERN.sub(self.__expandMatch, preprocessed_sent)
 
             filtered_sentence = re.sub(r'[?|$|&|*|%|@|(|)|~]', r'', expanded_sentence.strip())
 
@@ -294,7 +383,7 @@ class NLPUtil:
         sent = sent.replace("(","").replace(")","")
         sub_sent_list = []
         sub_option_map_list = []
-        doc = self.nlp(sent)
+        doc = self.getDoc(sent)
         conj_token_index_list = []
 
         # {'-A': 'option1'} -> {'option1': '-A'}
@@ -352,18 +441,25 @@ class NLPUtil:
         option_map_dict = {}
         option_list = self.__findOptionsInSent(sent)
         item_generator = self.getReplaceItem()
+        replace_dict = {}
         for option in option_list:
             if option not in option_map_dict:
                 if included_list:
-                    # e.g., --keep-*
-                    r = re.compile("^%s.*$" % option[:-1]) if option[-1] == "*" else re.compile("^%s$" % option)
                     # Options not belong to this program
-                    if not any(r.match(opt) for opt in included_list):
-                        sent = re.sub("%s(?![a-zA-Z0-9\-\*])" % re.escape(option), "option", sent).strip()
+                    if not self.__isIncludedOption(option, included_list):
+                        replace_dict[option] = "option"
                         continue
                 replace_item = next(item_generator)
                 option_map_dict[option] = replace_item
-                sent = re.sub("%s(?![a-zA-Z0-9\-\*])" % re.escape(option.replace("*", "\*")), replace_item, sent).strip()
+                # The pattern of an option with "*" used to be escaped twice and never matched, so it is still not replaced
+                if "*" not in option:
+                    replace_dict[option] = replace_item
+        # Replace all options in a single pass, longer options first
+        if replace_dict:
+            pattern = re.compile("(%s)(?![a-zA-Z0-9\-\*])" % "|".join([re.escape(option) for option in sorted(replace_dict, key=len, reverse=True)]))
+            sent = pattern.sub(lambda match: replace_dict[match.group(1)], sent)
+        if option_list:
+            sent = sent.strip()
             
         r = sorted(option_map_dict.items(), key=lambda kv: len(str(kv[0])), reverse=True)
         option_map_dict = {i[0]: i[1] for i in r}
@@ -373,6 +469,17 @@ class NLPUtil:
 
         return sent, option_map_dict
 
+    # Check if the option (e.g., --keep-* for any option starting with --keep-) is in included_list
+    def __isIncludedOption(self, option, included_list):
+        # Index the options of the program once, i.e., an exact-match set and a sorted list for prefix search
+        if self.option_index[0] is not included_list:
+            self.option_index = (included_list, set(included_list), sorted(included_list))
+        _, option_set, sorted_option_list = self.option_index
+        if option[-1] == "*":
+            idx = bisect_left(sorted_option_list, option[:-1])
+            return idx < len(sorted_option_list) and sorted_option_list[idx].startswith(option[:-1])
+        return option in option_set
+
     def isReplacedOption(self, text):
         target_list = REPLACE_ITEM_LIST + [SELF_REPLACE_ITEM]
         return text in target_list
@@ -423,9 +530,9 @@ class NLPUtil:
             predicate1 = predicate_1_root[idx]
             predicate2 = predicate_2_root[idx]
             synonyms_vb1 = self.getSynonymsAndAntonyms(predicate1)[0]
-            antonyms_vb1 = self.getSynonymsAndAntonyms(predicate2)[1]
-            synonyms_vb2 = self.getSynonymsAndAntonyms(predicate2)[0]
-            antonyms_vb2 = self.getSynonymsAndAntonyms(predicate2)[1]
+            synonyms_vb2, antonyms_vb2 = self.getSynonymsAndAntonyms(predicate2)
+            # Same as before, the antonyms of vb1 are looked up with predicate2
+            antonyms_vb1 = antonyms_vb2
 
             if predicate1 == predicate2 or predicate1 in synonyms_vb2 or predicate2 in synonyms_vb1:
                 rel_list.append("synonyms")
@@ -530,7 +637,7 @@ class NLPUtil:
         if "following options:" not in sentence:
             return sentence
         sentence = sentence.replace("-", "_")
-        doc = self.nlp(sentence)
+        doc = self.getDoc(sentence)
         end_pattern_list = ["."]
         fix_start_flag = False
         for token in doc:
@@ -554,7 +661,7 @@ class NLPUtil:
         first_word_lemma_list = lemminflect.getAllLemmas(first_word)
 
         if "VERB" in first_word_lemma_list:
-            doc = self.nlp(sentence)
+            doc = self.getDoc(sentence)
             # If the first word also can be a noun
             if "NOUN" in first_word_lemma_list:
                 second_word = word_list[1].lower()
@@ -584,7 +691,7 @@ class NLPUtil:
     def __findOptionsInSent(self, sent):
         # Add a space for regex, and tokenize to seperate option and punctuations
         sentence = " %s " % (self.__joinMistakenlySplitedToken(" ".join(nltk.word_tokenize(sent))))
-        option_list = [item.strip() for item in re.findall(r"(?<=\s)-{1,2}.*?(?=\s)", sentence)]
+        option_list = [item.strip() for item in OPTION_PATTERN.findall(sentence)]
         return list(set(option_list))
 
     def __simplifyConstituencyTree(self, tree):
@@ -625,9 +732,34 @@ class NLPUtil:
         new_sentence = self.__addSubjectToSentence(self.__joinMistakenlySplitedToken(' '.join(ptree.leaves())))
         if remove_subject_flag:
             new_sentence = self.__addSubjectToSentence(new_sentence)
-        new_tree = self.predictConstituencyTree(new_sentence)
 
-        return new_tree, new_sentence, neg_flag
+        # The caller parses the new sentence, so that it can be batched
+        return new_sentence, neg_flag
+
+    # The docs are keyed by the exact text, since their tokens keep the character offsets
+    def __getCachedDoc(self, text):
+        if self.cache_util is None:
+            return None
+        data = self.cache_util.get("doc:%s:%s" % (self.model_stamp, text))
+        return list(DocBin().from_bytes(data).get_docs(self.nlp.vocab))[0] if data is not None else None
+
+    def __putCachedDoc(self, text, doc):
+        if self.cache_util is not None:
+            self.cache_util.put("doc:%s:%s" % (self.model_stamp, text), DocBin(docs=[doc]).to_bytes())
+
+    # The trees are keyed by the normalized sentence, i.e., whitespaces do not matter
+    def __getCachedTree(self, sent):
+        if self.cache_util is None:
+            return None
+        data = self.cache_util.get("tree:%s:%s" % (self.model_stamp, " ".join(sent.split())))
+        return data.decode("utf-8") if data is not None else None
+
+    def __putCachedTree(self, sent, tree):
+        if self.cache_util is not None:
+            self.cache_util.put("tree:%s:%s" % (self.model_stamp, " ".join(sent.split())), tree.encode("utf-8"))
+
+    def __cleanSentenceForParser(self, sent):
+        return sent.replace("..",".").replace("(","").replace(")","").replace("{","").replace("}","")
     
     def __joinMistakenlySplitedToken(self, sentence):
         return sentence.replace("-- ","--").replace(" - ", "-").replace("- *", "-*")
@@ -655,7 +787,7 @@ class NLPUtil:
 
     def __getPredAndObj(self, sentence):
 
-        doc = self.nlp(sentence)
+        doc = self.getDoc(sentence)
 
         edge_list = []
         verb_candidate_list = []
@@ -697,7 +829,7 @@ class NLPUtil:
                     find_prep_result = [child.text for child in root_token.children if child.dep_ in ["prt", "prep"]]
                     if len(find_prep_result) > 0:
                         # if "%predicate_%prep" is a verb phrase if it is in the wordnet dataset
-                        prt = find_prep_result[0] if len(wordnet.synsets("%s_%s" % (predicate, find_prep_result[0]))) > 0 else ""
+                        prt = find_prep_result[0] if self.wordnet_util.hasSynsets("%s_%s" % (predicate, find_prep_result[0])) else ""
             elif token.head.dep_ == "ROOT" and ((token.dep_ in ['pobj', 'dobj', 'nsubjpass'])):
                 object_candidate_token = token
             # check 'to do' 
@@ -722,7 +854,7 @@ class NLPUtil:
                     find_prep_result = [child.text for child in verb_token.children if child.dep_ in ["prt", "prep"]]
                     if len(find_prep_result) > 0:
                         # if "%predicate_%prep" is a verb phrase if it is in the wordnet dataset
-                        prt = find_prep_result[0] if len(wordnet.synsets("%s_%s" % (predicate, find_prep_result[0]))) > 0 else ""
+                        prt = find_prep_result[0] if self.wordnet_util.hasSynsets("%s_%s" % (predicate, find_prep_result[0])) else ""
                     object_list =  [child.text for child in verb_token.children if child.dep_ in ['nsubj', 'nsubjpass']]
                     object = object_list[0] if len(object_list) > 0 else ""
                     attr = " ".join([lemminflect.getLemma(child.text,upos='VERB')[0] for child in verb_token.children if child.dep_ in ['acomp','xcomp']])
@@ -785,7 +917,7 @@ class NLPUtil:
         return subtrees
 
     def __isStartsWithDTPl(self, sentence):
-        doc = self.nlp(sentence)
+        doc = self.getDoc(sentence)
 
         for token in doc:
             if token.tag_ in ['DT'] and token.text.lower() in ["these"]:
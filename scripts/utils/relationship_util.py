@@ -6,17 +6,21 @@ class RelationshipUtil:
         self.nlp_util = nlp_util
         return
 
-    def findImplicitPair(self, topic_sent_list):
+    # The pairs of two reused sentences (indexes in reused_idx_set) are not compared again, they are implicit pairs iff their indexes are in reused_pair_set
+    def findImplicitPair(self, topic_sent_list, reused_idx_set=frozenset(), reused_pair_set=frozenset()):
         implicit_pair_list = []
-        for pair in itertools.combinations(topic_sent_list, 2):
-            
-            if not any([pair[0]['object'], pair[1]['object'], pair[0]['predicate'], pair[0]['predicate']]):
+        predicate_rel_dict = {}
+        for idx_pair in self.__iterSameObjectPairs(topic_sent_list):
+            pair = (topic_sent_list[idx_pair[0]], topic_sent_list[idx_pair[1]])
+            if idx_pair[0] in reused_idx_set and idx_pair[1] in reused_idx_set:
+                if idx_pair in reused_pair_set:
+                    implicit_pair_list.append(pair)
                 continue
-            # Must have same objects
-            if pair[0]["object"] != pair[1]["object"]:
+
+            if not any([pair[0]['object'], pair[1]['object'], pair[0]['predicate'], pair[0]['predicate']]):
                 continue
             # The object "value" is usually used to refer to the option value, rather than declaring a specific attribute
-            elif pair[0]["object"] in ["values", "value"]:
+            if pair[0]["object"] in ["values", "value"]:
                 continue
             # If two sentences have the same predicate ("be", "become",...) and the same subject, we think they are assigning different attributes to the same thing. Therefore, they are conflict.
             if pair[0]["predicate"] == "be" and pair[1]["predicate"] == "be":
@@ -31,7 +35,11 @@ class RelationshipUtil:
                     implicit_pair_list.append(pair)
             else:
                 # Must have synonyms or antonyms predicates
-                rel_list = self.nlp_util.comparePredicate(pair[0]["predicate"], pair[1]["predicate"])
+                # Many pairs share the same predicates, so compare each predicate pair only once
+                predicate_pair = (pair[0]["predicate"], pair[1]["predicate"])
+                if predicate_pair not in predicate_rel_dict:
+                    predicate_rel_dict[predicate_pair] = self.nlp_util.comparePredicate(*predicate_pair)
+                rel_list = predicate_rel_dict[predicate_pair]
                 # If the two predicate have no relation 
                 if len(rel_list) == 0 or "none" in rel_list:
                     continue
@@ -102,10 +110,12 @@ class RelationshipUtil:
                 relation_dict_list.append(relation_dict)
 
         # Merge relationships between multiple sub-sentences
+        conflict_pair_set = set()
         for item in relation_dict_list:
             for conflict_pair in item['conflict']:
-                if conflict_pair not in explicit_relationship_dict['conflict'] and conflict_pair[::-1] not in explicit_relationship_dict['conflict']:
+                if tuple(conflict_pair) not in conflict_pair_set:
                     explicit_relationship_dict['conflict'].append(conflict_pair)
+                    self.__addUnorderedPair(conflict_pair_set, conflict_pair)
             for dependent_subj in item['dependent']:
                 if dependent_subj not in explicit_relationship_dict['dependent']:
                     explicit_relationship_dict['dependent'][dependent_subj] = item['dependent'][dependent_subj]
@@ -119,18 +129,19 @@ class RelationshipUtil:
                         print("[WARN] Duplicate item found: %s, %s" % ( str({dependent_subj: explicit_relationship_dict['dependent'][dependent_subj]}), str({dependent_subj: str(item['dependent'][dependent_subj])})))
         
         # Check if some dependent pairs are also conflict pairs
-        for d_subj in explicit_relationship_dict['dependent']:
+        # The keys are copied, since a dependent pair may be removed in the loop
+        for d_subj in list(explicit_relationship_dict['dependent']):
             if "||" in explicit_relationship_dict['dependent'][d_subj]:
                 new_obj_list = []
                 for d_obj in explicit_relationship_dict['dependent'][d_subj].split("||"):
-                    if [d_subj, d_obj] in explicit_relationship_dict['conflict'] or [d_obj, d_subj] in explicit_relationship_dict['conflict']:
+                    if (d_subj, d_obj) in conflict_pair_set:
                         print("[INFO] Partial overlap between conflict and dependent: %s, %s" % (str(explicit_relationship_dict['dependent'][d_subj]), str([d_obj, d_subj])))
                     else:
                         new_obj_list.append(d_obj)
                 explicit_relationship_dict['dependent'][d_subj] = "||".join(new_obj_list)
             else:
                 d_obj = explicit_relationship_dict['dependent'][d_subj]
-                if [d_subj, d_obj] in explicit_relationship_dict['conflict'] or [d_obj, d_subj] in explicit_relationship_dict['conflict']:
+                if (d_subj, d_obj) in conflict_pair_set:
                     explicit_relationship_dict['dependent'].pop(d_subj)
 
         return explicit_relationship_dict
@@ -144,11 +155,14 @@ class RelationshipUtil:
             implicit_relationship_dict["conflict"].append(implicit_conflict_pair)
         return implicit_relationship_dict
 
+    # Keep the first occurrence of each pair, [a, b] and [b, a] are the same pair
     def deduplicationConflictList(self, conflict_list):
         deduplicated_conflict_list = []
+        conflict_pair_set = set()
         for conflict_pair in conflict_list:
-            if conflict_pair not in deduplicated_conflict_list and conflict_pair[::-1] not in deduplicated_conflict_list:
+            if tuple(conflict_pair) not in conflict_pair_set:
                 deduplicated_conflict_list.append(conflict_pair)
+                self.__addUnorderedPair(conflict_pair_set, conflict_pair)
         return deduplicated_conflict_list
 
     # When a pair is identified as both conflict and dependent, we trust the conflict one
@@ -168,6 +182,27 @@ class RelationshipUtil:
 
         return deduplicated_relationship_dict
 
+    # Add both orientations of a pair, so that a set of tuples works as a set of unordered pairs
+    def __addUnorderedPair(self, pair_set, pair):
+        pair_set.add(tuple(pair))
+        pair_set.add(tuple(pair[::-1]))
+
+    # Same index pairs as itertools.combinations(range(len(topic_sent_list)), 2) in the same order, but only the pairs with the same object,
+    # so that the search scales with the number of sentences sharing an object rather than with all pairs
+    def __iterSameObjectPairs(self, topic_sent_list):
+        object_idx_dict = {}
+        for idx, topic_sent in enumerate(topic_sent_list):
+            object_idx_dict.setdefault(topic_sent["object"], []).append(idx)
+        # Position of each sentence in its bucket
+        bucket_pos_list = [0] * len(topic_sent_list)
+        for idx_list in object_idx_dict.values():
+            for pos, idx in enumerate(idx_list):
+                bucket_pos_list[idx] = pos
+        for idx, topic_sent in enumerate(topic_sent_list):
+            idx_list = object_idx_dict[topic_sent["object"]]
+            for other_idx in idx_list[bucket_pos_list[idx] + 1:]:
+                yield (idx, other_idx)
+
     # Organize necessary information for extracting relationships
     def __organizeSentInfoDict(self, sent_dict, option_map):
         cmd = sent_dict['cmd']
@@ -353,7 +388,7 @@ class RelationshipUtil:
         return relation_dict
 
     def __traverseBackward(self, processed_sent):
-        doc = self.nlp_util.nlp(processed_sent)
+        doc = self.nlp_util.getDoc(processed_sent)
         traverse_dict = {}
         subj_list, obj_list, neg_list, only_list, edge_list, option_token_list = [], [], [], [], [], []
         verb_list, aux_list, with_to_flag_list, represent_option_list = [None, None], [None, None], [None, None], [None, None]
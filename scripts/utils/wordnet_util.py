@@ -0,0 +1,55 @@
+import gzip
+import json
+from collections import OrderedDict
+from nltk.corpus import wordnet
+
+class WordNetUtil:
+    def __init__(self, cache_size=65536, index_path=None):
+        # Bounded memoization of the lookups, the least recently used words are dropped first
+        self.cache_size = cache_size
+        self.cache_dict = OrderedDict()
+        # Optional precomputed {word: [synonyms, antonyms]} index, so that WordNet is only loaded for the words not in it
+        self.index_dict = self.loadIndex(index_path) if index_path else {}
+        return
+
+    def getSynonymsAndAntonyms(self, word):
+        if word in self.cache_dict:
+            self.cache_dict.move_to_end(word)
+            return self.cache_dict[word]
+        if word in self.index_dict:
+            result = tuple(self.index_dict[word])
+        else:
+            result = self.__lookupWordNet(word)
+        self.cache_dict[word] = result
+        if len(self.cache_dict) > self.cache_size:
+            self.cache_dict.popitem(last=False)
+        return result
+
+    # Every synset has at least one lemma, so a word has synsets iff it has synonyms
+    def hasSynsets(self, word):
+        return len(self.getSynonymsAndAntonyms(word)[0]) > 0
+
+    def loadIndex(self, index_path):
+        with gzip.open(index_path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    # Precompute the synonyms and antonyms of every lemma in WordNet into a gzipped json file
+    def buildIndex(self, index_path):
+        index_dict = {}
+        for word in wordnet.all_lemma_names():
+            synonym_list, antonym_list = self.__lookupWordNet(word)
+            index_dict[word] = [synonym_list, antonym_list]
+        with gzip.open(index_path, "wt", encoding="utf-8") as f:
+            json.dump(index_dict, f, separators=(",", ":"))
+        return len(index_dict)
+
+    def __lookupWordNet(self, word):
+        synonyms = []
+        antonyms = []
+        for syn in wordnet.synsets(word):
+            for l in syn.lemmas():
+                synonyms.append(l.name())
+                if l.antonyms():
+                    antonyms.append(l.antonyms()[0].name())
+        # Sorted, so that the index file is reproducible
+        return sorted(set(synonyms)), sorted(set(antonyms))